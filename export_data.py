@@ -0,0 +1,64 @@
+"""Export a tenant's products or inventory logs without loading them into memory.
+
+Usage:
+    DB_URL=postgresql://... python export_data.py USER_ID {products,inventory_logs}
+        [--format csv|parquet] [--output FILE] [--start YYYY-MM-DD] [--end YYYY-MM-DD]
+        [--product-id ID]
+
+CSV is streamed with COPY TO STDOUT; Parquet is written one row group per
+server-side cursor batch and needs pyarrow. ``--end`` is inclusive.
+"""
+import argparse
+import sys
+from datetime import datetime, timedelta
+
+import main
+
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Stream a tenant's data to CSV or Parquet")
+    parser.add_argument("user_id", type=int, help="Tenant to export")
+    parser.add_argument("kind", choices=main.EXPORT_KINDS, help="Dataset to export")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--output", help="Destination file; defaults to stdout for CSV")
+    parser.add_argument("--start", type=parse_date, help="First log date to include (inventory_logs only)")
+    parser.add_argument("--end", type=parse_date, help="Last log date to include (inventory_logs only)")
+    parser.add_argument("--product-id", type=int, help="Only export logs for this product")
+    parser.add_argument("--batch-size", type=int, default=main.EXPORT_BATCH_SIZE,
+                        help="Rows fetched per server-side cursor round trip (Parquet)")
+    return parser.parse_args()
+
+
+def run():
+    args = parse_args()
+    filters = {}
+    if args.kind == "inventory_logs":
+        filters = {"start": args.start, "product_id": args.product_id,
+                   "end": args.end + timedelta(days=1) if args.end else None}
+    elif args.start or args.end or args.product_id:
+        sys.exit("--start, --end and --product-id only apply to inventory_logs")
+
+    if args.format == "parquet" and not args.output:
+        sys.exit("--output is required for Parquet exports")
+
+    main.EXPORT_BATCH_SIZE = args.batch_size
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        if args.format == "csv":
+            main.export_csv(args.kind, out, args.user_id, **filters)
+        else:
+            rows = main.export_parquet(args.kind, out, args.user_id, **filters)
+            print(f"Wrote {rows} row(s) to {args.output}", file=sys.stderr)
+    except ValueError as e:
+        sys.exit(str(e))
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == "__main__":
+    run()
@@ -1,299 +1,2519 @@
 import streamlit as st
 import psycopg2
+from psycopg2 import extensions as pg_extensions
+from psycopg2 import pool as pg_pool
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import bcrypt
+import openpyxl
+import bisect
+import cProfile
+import csv
+import functools
+import hashlib
+import heapq
+import hmac
+import io
+import inspect
+import json
+import logging
+import math
+import multiprocessing
 import os
-from datetime import datetime
+import re
+import secrets
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timedelta
 import urllib.parse
 
+# Connection pool settings (overridable through environment variables)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "10"))
+DB_POOL_RECYCLE_SECONDS = float(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+DB_POOL_PING_AFTER_SECONDS = float(os.getenv("DB_POOL_PING_AFTER_SECONDS", "30"))
+
+# Read cache lifetime; 0 disables caching of query results. The cache holds
+# at most QUERY_CACHE_MAX_ENTRIES results across all users.
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "300"))
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "1000"))
+
+# Query instrumentation; METRICS_PORT > 0 also serves Prometheus text on
+# METRICS_HOST:METRICS_PORT/metrics (loopback unless opened up explicitly).
+# The ?page=metrics view is off unless METRICS_ADMIN_PHONES lists who may see it.
+DB_METRICS_ENABLED = os.getenv("DB_METRICS", "1") != "0"
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "500"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_ADMIN_PHONES = set(filter(None, (p.strip() for p in os.getenv("METRICS_ADMIN_PHONES", "").split(","))))
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Render profiling, per session with ?profile=1 (or for everyone with PROFILE_RERUNS=1).
+# PROFILE_DUMP_DIR also writes each profiled rerun's cProfile stats there.
+PROFILE_RERUNS = os.getenv("PROFILE_RERUNS", "0") == "1"
+PROFILE_DUMP_DIR = os.getenv("PROFILE_DUMP_DIR", "")
+PROFILE_HISTORY = int(os.getenv("PROFILE_HISTORY", "20"))
+
+logger = logging.getLogger("inventory_tracker")
+
+class Histogram:
+    """Cumulative-bucket latency histogram in milliseconds"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q):
+        """Upper bucket bound containing the ``q`` quantile, or None with no observations"""
+        if not self.count:
+            return None
+        target, seen = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+class DBMetrics:
+    """Process-wide statement, pool and per-rerun connection statistics.
+
+    Statements are grouped by the main.py function that issued them. The
+    per-thread rerun counter lives here rather than at module level because
+    Streamlit re-executes this file on every rerun.
+    """
+
+    def __init__(self, slow_limit=25):
+        self._lock = threading.Lock()
+        self.local = threading.local()
+        self.queries = {}
+        self.rows = {}
+        self.errors = {}
+        self.tenants = {}
+        self.acquire = Histogram()
+        self.connections_per_rerun = {}
+        self.slow_limit = slow_limit
+        self.slowest = []
+
+    def record_query(self, name, user_id, elapsed_ms, rows, statement, failed):
+        with self._lock:
+            self.queries.setdefault(name, Histogram()).observe(elapsed_ms)
+            self.rows[name] = self.rows.get(name, 0) + max(rows, 0)
+            if failed:
+                self.errors[name] = self.errors.get(name, 0) + 1
+            if user_id is not None:
+                tenant = self.tenants.setdefault(user_id, [0, 0.0])
+                tenant[0] += 1
+                tenant[1] += elapsed_ms
+            if len(self.slowest) < self.slow_limit or elapsed_ms > self.slowest[0][0]:
+                entry = (elapsed_ms, time.time(), name, user_id, statement() if callable(statement) else statement)
+                if len(self.slowest) < self.slow_limit:
+                    heapq.heappush(self.slowest, entry)
+                else:
+                    heapq.heapreplace(self.slowest, entry)
+        if elapsed_ms >= DB_SLOW_QUERY_MS:
+            logger.warning("slow query %s took %.1f ms (user %s, %d rows)", name, elapsed_ms, user_id, rows)
+
+    def record_acquire(self, elapsed_ms):
+        with self._lock:
+            self.acquire.observe(elapsed_ms)
+        if getattr(self.local, "connections", None) is not None:
+            self.local.connections += 1
+
+    def begin_rerun(self):
+        self.local.connections = 0
+
+    def end_rerun(self):
+        connections, self.local.connections = getattr(self.local, "connections", None), None
+        if connections is not None:
+            with self._lock:
+                self.connections_per_rerun[connections] = self.connections_per_rerun.get(connections, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "queries": [
+                    (name, h.count, h.total, h.total / h.count, h.quantile(0.95), self.rows.get(name, 0), self.errors.get(name, 0))
+                    for name, h in self.queries.items()
+                ],
+                "tenants": [(user_id, count, total) for user_id, (count, total) in self.tenants.items()],
+                "slowest": sorted(self.slowest, reverse=True),
+                "acquire": (self.acquire.count, self.acquire.total, self.acquire.quantile(0.95)),
+                "connections_per_rerun": dict(sorted(self.connections_per_rerun.items())),
+            }
+
+    def prometheus(self):
+        """Render the metrics in the Prometheus text exposition format"""
+        lines = []
+        
+        def histogram(metric, h, labels=""):
+            seen = 0
+            for bound, count in zip(h.buckets, h.counts):
+                seen += count
+                lines.append(f'{metric}_bucket{{{labels}{"," if labels else ""}le="{bound / 1000:g}"}} {seen}')
+            lines.append(f'{metric}_bucket{{{labels}{"," if labels else ""}le="+Inf"}} {h.count}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{metric}_sum{suffix} {h.total / 1000:.6f}")
+            lines.append(f"{metric}_count{suffix} {h.count}")
+        
+        with self._lock:
+            lines.append("# TYPE inventory_db_query_duration_seconds histogram")
+            for name, h in sorted(self.queries.items()):
+                histogram("inventory_db_query_duration_seconds", h, f'query="{name}"')
+            lines.append("# TYPE inventory_db_query_rows_total counter")
+            lines.extend(f'inventory_db_query_rows_total{{query="{name}"}} {rows}' for name, rows in sorted(self.rows.items()))
+            lines.append("# TYPE inventory_db_query_errors_total counter")
+            lines.extend(f'inventory_db_query_errors_total{{query="{name}"}} {count}' for name, count in sorted(self.errors.items()))
+            lines.append("# TYPE inventory_db_pool_acquire_seconds histogram")
+            histogram("inventory_db_pool_acquire_seconds", self.acquire)
+            lines.append("# TYPE inventory_reruns_total counter")
+            lines.extend(f'inventory_reruns_total{{connections="{n}"}} {count}' for n, count in sorted(self.connections_per_rerun.items()))
+        return "\n".join(lines) + "\n"
+
+@st.cache_resource(show_spinner=False)
+def get_db_metrics():
+    return DBMetrics()
+
+def _statement_origin():
+    """Name and ``user_id`` local of the main.py function running a statement"""
+    frame = sys._getframe(3)
+    while frame is not None and frame.f_code.co_filename != __file__:
+        frame = frame.f_back
+    if frame is None:
+        return "unknown", None
+    user_id = frame.f_locals.get("user_id")
+    return frame.f_code.co_name, user_id if isinstance(user_id, int) else None
+
+class InstrumentedCursor(pg_extensions.cursor):
+    """Cursor that reports every statement's latency and row count to DBMetrics"""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute(query, vars)
+            failed = False
+            return result
+        finally:
+            self._record(started, failed)
+
+    def copy_expert(self, query, file, size=8192):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = super().copy_expert(query, file, size)
+            failed = False
+            return result
+        finally:
+            self._record(started, failed)
+
+    def _record(self, started, failed):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        name, user_id = _statement_origin()
+        get_db_metrics().record_query(
+            name, user_id, elapsed_ms, self.rowcount, lambda: (self.query or b"").decode(errors="replace")[:500], failed
+        )
+
+@st.cache_resource(show_spinner=False)
+def start_metrics_server(host, port):
+    """Serve get_db_metrics() as Prometheus text on host:port/metrics from a daemon thread"""
+    metrics = get_db_metrics()
+    
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            pass
+    
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+class RerunProfiler:
+    """Nested wall-clock timings of one rerun's sections, in milliseconds.
+
+    Section names start with a phase ("fetch: ...", "dataframe: ...",
+    "chart: ...", "render: ..."), and self time is summed per phase. Pages
+    run inside a "render: <page>" section, so page time outside their fetch,
+    DataFrame and chart sections counts as widget rendering. The profiler
+    lives in st.session_state, so each browser session profiles only its
+    own reruns.
+    """
+
+    def __init__(self):
+        self.stack = []
+        self.sections = {}
+        self.page = None
+        self.dump_path = None
+
+    @contextmanager
+    def section(self, name):
+        self.stack.append(name)
+        # Registered on entry so parents come before their children
+        entry = self.sections.setdefault(tuple(self.stack), [0.0, 0])
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry[0] += (time.perf_counter() - started) * 1000
+            entry[1] += 1
+            self.stack.pop()
+
+    @property
+    def total_ms(self):
+        return sum(ms for path, (ms, _) in self.sections.items() if len(path) == 1)
+
+    def self_times(self):
+        """Time spent in each section outside its child sections"""
+        own = {path: ms for path, (ms, _) in self.sections.items()}
+        for path, (ms, _) in self.sections.items():
+            if len(path) > 1:
+                own[path[:-1]] -= ms
+        return {path: max(ms, 0.0) for path, ms in own.items()}
+
+    def phases(self):
+        """Self time summed by nearest enclosing phase; unphased time counts as other"""
+        totals = {}
+        for path, ms in self.self_times().items():
+            phase = next((name.split(":", 1)[0] for name in reversed(path) if ":" in name), "other")
+            totals[phase] = totals.get(phase, 0.0) + ms
+        return totals
+
+@contextmanager
+def profile_section(name):
+    """Time the enclosed block as ``name`` when this rerun is being profiled"""
+    profiler = st.session_state.get("profiler")
+    if profiler is None:
+        yield
+        return
+    with profiler.section(name):
+        yield
+
+def profiling_requested():
+    """?profile=1 turns profiling on for a session and ?profile=0 off, overriding PROFILE_RERUNS"""
+    requested = st.query_params.get("profile")
+    return requested == "1" if requested is not None else PROFILE_RERUNS
+
+def run_profiled(app):
+    """Run one rerun of ``app`` under a RerunProfiler, plus cProfile when PROFILE_DUMP_DIR is set"""
+    profiler = st.session_state.profiler = RerunProfiler()
+    history = st.session_state.setdefault("profile_history", [])
+    stats = cProfile.Profile() if PROFILE_DUMP_DIR else None
+    if stats is not None:
+        try:
+            stats.enable()
+        except ValueError:
+            # Python 3.12+ allows one active profiler per process; another rerun has it
+            stats = None
+    try:
+        with profiler.section("rerun"):
+            app()
+    finally:
+        if stats is not None:
+            stats.disable()
+        profiler.page = st.session_state.get("current_page") if st.session_state.get("user") else "login"
+        if stats is not None:
+            os.makedirs(PROFILE_DUMP_DIR, exist_ok=True)
+            profiler.dump_path = os.path.join(PROFILE_DUMP_DIR, f"{datetime.now():%Y%m%d-%H%M%S-%f}-{profiler.page}.prof")
+            stats.dump_stats(profiler.dump_path)
+        history.append({"page": profiler.page, "total_ms": profiler.total_ms, **profiler.phases()})
+        del history[:-PROFILE_HISTORY]
+    # Reruns cut short by st.rerun()/st.stop() raise past this, so they are recorded but not drawn
+    show_profile_breakdown(profiler, history)
+
+class ConnectionPool:
+    """Thread-safe psycopg2 pool shared by every Streamlit session.
+
+    ``min_size`` connections are opened up front and more are opened on
+    demand, up to ``max_size``; returned connections stay open for reuse.
+    Checkouts block (up to ``timeout`` seconds) instead of failing when all
+    connections are busy. Connections older than ``recycle_seconds`` are
+    replaced, and connections idle for longer than ``ping_after_seconds``
+    are pinged with ``SELECT 1`` before being handed out.
+    """
+
+    def __init__(self, dsn, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 timeout=DB_POOL_TIMEOUT_SECONDS, recycle_seconds=DB_POOL_RECYCLE_SECONDS,
+                 ping_after_seconds=DB_POOL_PING_AFTER_SECONDS):
+        self.dsn = dsn
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.recycle_seconds = recycle_seconds
+        self.ping_after_seconds = ping_after_seconds
+        self._connect_kwargs = {"cursor_factory": InstrumentedCursor} if DB_METRICS_ENABLED else {}
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._lock = threading.Lock()
+        # Idle connections, most recently returned last; the semaphore keeps
+        # checked-out plus idle connections at or below ``max_size``
+        self._idle = []
+        self._created_at = {}
+        self._last_used = {}
+        for _ in range(min(min_size, self.max_size)):
+            self._idle.append(self._open())
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise pg_pool.PoolError("Timed out waiting for a free database connection")
+        try:
+            return self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        try:
+            if not conn.closed and conn.info.transaction_status != pg_extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            pass
+        try:
+            if conn.closed:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._last_used[id(conn)] = time.monotonic()
+                    self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
+
+    def _open(self):
+        conn = psycopg2.connect(self.dsn, **self._connect_kwargs)
+        with self._lock:
+            self._created_at[id(conn)] = time.monotonic()
+        return conn
+
+    def _checkout(self):
+        # Reuse the most recently returned connection so the others can go
+        # stale and be recycled; open a new one when none is idle and healthy
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._open()
+            if self._is_healthy(conn):
+                return conn
+            self._discard(conn)
+
+    def _is_healthy(self, conn):
+        now = time.monotonic()
+        with self._lock:
+            created_at = self._created_at.get(id(conn), now)
+            last_used = self._last_used.get(id(conn), now)
+        if conn.closed or now - created_at > self.recycle_seconds:
+            return False
+        if now - last_used < self.ping_after_seconds:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created_at.pop(id(conn), None)
+            self._last_used.pop(id(conn), None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+def get_database_url():
+    """Read DB_URL from Streamlit secrets first, then from the environment"""
+    try:
+        db_url = st.secrets.get("DB_URL")
+    except FileNotFoundError:
+        db_url = None
+    return db_url or os.getenv("DB_URL")
+
+@st.cache_resource(show_spinner=False)
+def get_connection_pool(db_url):
+    """Process-wide connection pool, created once and shared by all sessions"""
+    return ConnectionPool(db_url)
+
 # Database connection function
+@contextmanager
 def get_connection():
-
-    # Try Streamlit secrets first, then environment variable
-    db_url = st.secrets.get("DB_URL") or os.getenv("DB_URL")
+    """Borrow a pooled connection; uncommitted work is rolled back on return"""
+    db_url = get_database_url()
     if not db_url:
         st.error("Database URL not configured. Please add DB_URL to secrets.")
         st.stop()
-    return psycopg2.connect(db_url)
+    pool = get_connection_pool(db_url)
+    started = time.perf_counter()
+    conn = pool.getconn()
+    if DB_METRICS_ENABLED:
+        get_db_metrics().record_acquire((time.perf_counter() - started) * 1000)
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+class QueryCache:
+    """In-memory cache of query results, partitioned per user.
+
+    Every write bumps the user's version counter and drops their entries.
+    A result is only stored if the version it was read under is still
+    current, so a read racing a write can't put stale rows back. Entries
+    are kept in insertion order: expired ones are purged on every store,
+    and the oldest are evicted beyond ``max_entries``.
+    """
+
+    def __init__(self, ttl, max_entries=QUERY_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._user_keys = {}
+        self._versions = {}
+
+    def version(self, user_id):
+        with self._lock:
+            return self._versions.get(user_id, 0)
+
+    def get(self, user_id, key):
+        """Return ``(hit, value)`` for a cached result"""
+        with self._lock:
+            entry = self._entries.get((user_id, key))
+            if entry is None:
+                return False, None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl:
+                self._remove((user_id, key))
+                return False, None
+            return True, value
+
+    def set(self, user_id, key, value, version):
+        with self._lock:
+            if self._versions.get(user_id, 0) != version:
+                return
+            now = time.monotonic()
+            self._entries.pop((user_id, key), None)
+            self._entries[(user_id, key)] = (now, value)
+            self._user_keys.setdefault(user_id, set()).add(key)
+            while self._entries:
+                oldest, (stored_at, _) = next(iter(self._entries.items()))
+                if len(self._entries) <= self.max_entries and now - stored_at <= self.ttl:
+                    break
+                self._remove(oldest)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            for key in self._user_keys.pop(user_id, ()):
+                self._entries.pop((user_id, key), None)
 
-    # Your Neon database URL
+    def _remove(self, entry_key):
+        user_id, key = entry_key
+        self._entries.pop(entry_key, None)
+        keys = self._user_keys.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[user_id]
 
+@st.cache_resource(show_spinner=False)
+def get_query_cache():
+    """Process-wide query cache shared by all sessions"""
+    return QueryCache(QUERY_CACHE_TTL_SECONDS)
+
+def invalidate_user_cache(user_id):
+    """Drop cached reads for a user; call after every committed write"""
+    get_query_cache().invalidate(user_id)
+
+def cached_query(entity):
+    """Cache a read helper's result per (user_id, entity, arguments)"""
+    def decorator(func):
+        signature = inspect.signature(func)
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = get_query_cache()
+            if cache.ttl <= 0:
+                return func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            user_id = bound.arguments["user_id"]
+            key = (entity, tuple(bound.arguments.items()))
+            hit, value = cache.get(user_id, key)
+            if hit:
+                return value
+            version = cache.version(user_id)
+            value = func(*args, **kwargs)
+            cache.set(user_id, key, value, version)
+            return value
+        
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+# Schema migrations, applied in order and recorded in schema_migrations.
+# Never edit a released entry; append a new version instead.
+MIGRATIONS = [
+    (1, "create users table", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL,
+            phone TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (2, "create shared tenant tables", [
+        """
+        CREATE TABLE IF NOT EXISTS suppliers (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            contact_number TEXT NOT NULL,
+            email TEXT,
+            address TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (user_id, id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS products (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            supplier_id INTEGER,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            min_threshold INTEGER NOT NULL DEFAULT 10,
+            unit_price DECIMAL(10,2),
+            category TEXT,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (user_id, id),
+            FOREIGN KEY (user_id, supplier_id) REFERENCES suppliers (user_id, id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS inventory_logs (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            product_id INTEGER,
+            action TEXT NOT NULL,
+            quantity_change INTEGER NOT NULL,
+            previous_quantity INTEGER NOT NULL,
+            new_quantity INTEGER NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id, product_id) REFERENCES products (user_id, id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS whatsapp_templates (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            template_text TEXT NOT NULL,
+            is_default BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS inventory_logs_user_id_idx ON inventory_logs (user_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS whatsapp_templates_user_id_idx ON whatsapp_templates (user_id, is_default DESC, name)",
+    ]),
+    (3, "index hot query paths", [
+        # Low-stock alerts: only rows at or below threshold are indexed, ordered by quantity
+        "CREATE INDEX IF NOT EXISTS products_low_stock_idx ON products (user_id, quantity) WHERE quantity <= min_threshold",
+        # Ordered product/supplier listings
+        "CREATE INDEX IF NOT EXISTS products_user_name_idx ON products (user_id, name, id)",
+        "CREATE INDEX IF NOT EXISTS suppliers_user_name_idx ON suppliers (user_id, name)",
+        # Supplier joins and the (user_id, supplier_id) foreign key check on supplier delete
+        "CREATE INDEX IF NOT EXISTS products_user_supplier_idx ON products (user_id, supplier_id)",
+        # Per-product movement history
+        "CREATE INDEX IF NOT EXISTS inventory_logs_product_time_idx ON inventory_logs (product_id, timestamp)",
+        "ANALYZE products",
+        "ANALYZE suppliers",
+        "ANALYZE inventory_logs",
+    ]),
+    (4, "maintain per-tenant inventory summary with triggers", [
+        """
+        CREATE TABLE IF NOT EXISTS inventory_summary (
+            user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+            product_count INTEGER NOT NULL DEFAULT 0,
+            low_stock_count INTEGER NOT NULL DEFAULT 0,
+            total_value NUMERIC NOT NULL DEFAULT 0,
+            supplier_count INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS inventory_category_summary (
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            category TEXT NOT NULL,
+            product_count INTEGER NOT NULL DEFAULT 0,
+            total_value NUMERIC NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, category)
+        )
+        """,
+        # Statement-level triggers fold a whole batch of changed rows into one
+        # delta per tenant: +1 for each new row version, -1 for each old one.
+        """
+        CREATE OR REPLACE FUNCTION products_summary_trigger() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            changed TEXT := CASE TG_OP
+                WHEN 'INSERT' THEN 'SELECT *, 1 AS sign FROM new_rows'
+                WHEN 'DELETE' THEN 'SELECT *, -1 AS sign FROM old_rows'
+                ELSE 'SELECT *, 1 AS sign FROM new_rows UNION ALL SELECT *, -1 AS sign FROM old_rows'
+            END;
+        BEGIN
+            EXECUTE format($sql$
+                WITH changed AS (%s)
+                INSERT INTO inventory_summary AS s (user_id, product_count, low_stock_count, total_value)
+                SELECT user_id, SUM(sign),
+                       SUM(sign * (quantity <= min_threshold)::integer),
+                       SUM(sign * COALESCE(unit_price * quantity, 0))
+                FROM changed
+                GROUP BY user_id
+                HAVING SUM(sign) <> 0 OR SUM(sign * (quantity <= min_threshold)::integer) <> 0
+                    OR SUM(sign * COALESCE(unit_price * quantity, 0)) <> 0
+                ON CONFLICT (user_id) DO UPDATE SET
+                    product_count = s.product_count + EXCLUDED.product_count,
+                    low_stock_count = s.low_stock_count + EXCLUDED.low_stock_count,
+                    total_value = s.total_value + EXCLUDED.total_value
+            $sql$, changed);
+            
+            EXECUTE format($sql$
+                WITH changed AS (%s)
+                INSERT INTO inventory_category_summary AS c (user_id, category, product_count, total_value)
+                SELECT user_id, category, SUM(sign), SUM(sign * COALESCE(unit_price * quantity, 0))
+                FROM changed
+                WHERE category IS NOT NULL
+                GROUP BY user_id, category
+                HAVING SUM(sign) <> 0 OR SUM(sign * COALESCE(unit_price * quantity, 0)) <> 0
+                ON CONFLICT (user_id, category) DO UPDATE SET
+                    product_count = c.product_count + EXCLUDED.product_count,
+                    total_value = c.total_value + EXCLUDED.total_value
+            $sql$, changed);
+            
+            IF TG_OP <> 'INSERT' THEN
+                DELETE FROM inventory_category_summary
+                WHERE product_count = 0 AND user_id IN (SELECT user_id FROM old_rows);
+            END IF;
+            RETURN NULL;
+        END
+        $$
+        """,
+        """
+        CREATE OR REPLACE FUNCTION suppliers_summary_trigger() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            EXECUTE format($sql$
+                INSERT INTO inventory_summary AS s (user_id, supplier_count)
+                SELECT user_id, %s * COUNT(*) FROM %I GROUP BY user_id
+                ON CONFLICT (user_id) DO UPDATE SET supplier_count = s.supplier_count + EXCLUDED.supplier_count
+            $sql$,
+            CASE TG_OP WHEN 'INSERT' THEN 1 ELSE -1 END,
+            CASE TG_OP WHEN 'INSERT' THEN 'new_rows' ELSE 'old_rows' END);
+            RETURN NULL;
+        END
+        $$
+        """,
+        """
+        CREATE TRIGGER products_summary_insert AFTER INSERT ON products
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION products_summary_trigger()
+        """,
+        """
+        CREATE TRIGGER products_summary_update AFTER UPDATE ON products
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION products_summary_trigger()
+        """,
+        """
+        CREATE TRIGGER products_summary_delete AFTER DELETE ON products
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION products_summary_trigger()
+        """,
+        """
+        CREATE TRIGGER suppliers_summary_insert AFTER INSERT ON suppliers
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION suppliers_summary_trigger()
+        """,
+        """
+        CREATE TRIGGER suppliers_summary_delete AFTER DELETE ON suppliers
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION suppliers_summary_trigger()
+        """,
+        # Backfill; the triggers above already block concurrent writers until commit
+        """
+        INSERT INTO inventory_summary (user_id, product_count, low_stock_count, total_value, supplier_count)
+        SELECT u.id, COALESCE(p.product_count, 0), COALESCE(p.low_stock_count, 0),
+               COALESCE(p.total_value, 0), COALESCE(s.supplier_count, 0)
+        FROM users u
+        LEFT JOIN (
+            SELECT user_id, COUNT(*) AS product_count,
+                   COUNT(*) FILTER (WHERE quantity <= min_threshold) AS low_stock_count,
+                   SUM(COALESCE(unit_price * quantity, 0)) AS total_value
+            FROM products GROUP BY user_id
+        ) p ON p.user_id = u.id
+        LEFT JOIN (SELECT user_id, COUNT(*) AS supplier_count FROM suppliers GROUP BY user_id) s ON s.user_id = u.id
+        ON CONFLICT (user_id) DO NOTHING
+        """,
+        """
+        INSERT INTO inventory_category_summary (user_id, category, product_count, total_value)
+        SELECT user_id, category, COUNT(*), SUM(COALESCE(unit_price * quantity, 0))
+        FROM products WHERE category IS NOT NULL
+        GROUP BY user_id, category
+        ON CONFLICT (user_id, category) DO NOTHING
+        """,
+    ]),
+    (5, "partition inventory_logs by month and add daily rollups", [
+        # Swap the plain table for a partitioned one, keeping ids from the same sequence
+        "ALTER SEQUENCE inventory_logs_id_seq OWNED BY NONE",
+        "ALTER TABLE inventory_logs RENAME TO inventory_logs_unpartitioned",
+        "DROP INDEX IF EXISTS inventory_logs_user_id_idx",
+        "DROP INDEX IF EXISTS inventory_logs_product_time_idx",
+        """
+        CREATE TABLE inventory_logs (
+            id INTEGER NOT NULL DEFAULT nextval('inventory_logs_id_seq'),
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            product_id INTEGER,
+            action TEXT NOT NULL,
+            quantity_change INTEGER NOT NULL,
+            previous_quantity INTEGER NOT NULL,
+            new_quantity INTEGER NOT NULL,
+            timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, timestamp),
+            FOREIGN KEY (user_id, product_id) REFERENCES products (user_id, id)
+        ) PARTITION BY RANGE (timestamp)
+        """,
+        "ALTER SEQUENCE inventory_logs_id_seq OWNED BY inventory_logs.id",
+        # Catches rows for months that have no partition yet; maintenance moves them out
+        "CREATE TABLE inventory_logs_default PARTITION OF inventory_logs DEFAULT",
+        "CREATE INDEX inventory_logs_user_id_idx ON inventory_logs (user_id, timestamp)",
+        "CREATE INDEX inventory_logs_product_time_idx ON inventory_logs (product_id, timestamp)",
+        # Creates one inventory_logs_YYYYMM partition per missing month, moving
+        # any rows the default partition already holds for that month into it.
+        """
+        CREATE OR REPLACE FUNCTION create_inventory_log_partitions(from_month TIMESTAMP, to_month TIMESTAMP)
+        RETURNS INTEGER LANGUAGE plpgsql AS $$
+        DECLARE
+            month_start TIMESTAMP := date_trunc('month', from_month);
+            part_name TEXT;
+            created INTEGER := 0;
+        BEGIN
+            WHILE month_start <= to_month LOOP
+                part_name := 'inventory_logs_' || to_char(month_start, 'YYYYMM');
+                IF to_regclass(part_name) IS NULL THEN
+                    LOCK TABLE inventory_logs_default IN EXCLUSIVE MODE;
+                    EXECUTE format('CREATE TABLE %I (LIKE inventory_logs INCLUDING DEFAULTS)', part_name);
+                    EXECUTE format($sql$
+                        WITH moved AS (
+                            DELETE FROM inventory_logs_default
+                            WHERE timestamp >= %L AND timestamp < %L
+                            RETURNING *
+                        )
+                        INSERT INTO %I SELECT * FROM moved
+                    $sql$, month_start, month_start + interval '1 month', part_name);
+                    EXECUTE format('ALTER TABLE inventory_logs ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                                   part_name, month_start, month_start + interval '1 month');
+                    created := created + 1;
+                END IF;
+                month_start := month_start + interval '1 month';
+            END LOOP;
+            RETURN created;
+        END
+        $$
+        """,
+        """
+        SELECT create_inventory_log_partitions(
+            COALESCE((SELECT MIN(timestamp) FROM inventory_logs_unpartitioned), LOCALTIMESTAMP),
+            LOCALTIMESTAMP + interval '3 months'
+        )
+        """,
+        """
+        INSERT INTO inventory_logs (id, user_id, product_id, action, quantity_change,
+                                    previous_quantity, new_quantity, timestamp)
+        SELECT id, user_id, product_id, action, quantity_change,
+               previous_quantity, new_quantity, COALESCE(timestamp, CURRENT_TIMESTAMP)
+        FROM inventory_logs_unpartitioned
+        """,
+        "DROP TABLE inventory_logs_unpartitioned",
+        # Per-product daily totals for months whose raw partitions have expired
+        """
+        CREATE TABLE IF NOT EXISTS inventory_log_daily (
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            product_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            units_in BIGINT NOT NULL,
+            units_out BIGINT NOT NULL,
+            net_change BIGINT NOT NULL,
+            changes INTEGER NOT NULL,
+            closing_quantity INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day, product_id),
+            FOREIGN KEY (user_id, product_id) REFERENCES products (user_id, id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS inventory_log_daily_product_idx ON inventory_log_daily (product_id, day)",
+        "ANALYZE inventory_logs",
+    ]),
+    (6, "version whatsapp templates", [
+        "ALTER TABLE whatsapp_templates ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP",
+    ]),
+    (7, "add outbound message queue", [
+        """
+        CREATE TABLE IF NOT EXISTS message_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            supplier_name TEXT,
+            phone TEXT NOT NULL,
+            message TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sending', 'sent', 'failed')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            available_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            claimed_at TIMESTAMP,
+            sent_at TIMESTAMP,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Worker claims: only undelivered rows are indexed
+        "CREATE INDEX IF NOT EXISTS message_outbox_due_idx ON message_outbox (available_at, id) WHERE status IN ('pending', 'sending')",
+        "CREATE INDEX IF NOT EXISTS message_outbox_user_idx ON message_outbox (user_id, created_at)",
+    ]),
+    (8, "add purchase orders", [
+        """
+        CREATE TABLE IF NOT EXISTS purchase_orders (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            supplier_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'open' CHECK (status IN ('open', 'received', 'cancelled')),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            closed_at TIMESTAMP,
+            UNIQUE (user_id, id),
+            FOREIGN KEY (user_id, supplier_id) REFERENCES suppliers (user_id, id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS purchase_order_lines (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            purchase_order_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL CHECK (quantity > 0),
+            unit_price DECIMAL(10,2),
+            received_quantity INTEGER,
+            UNIQUE (purchase_order_id, product_id),
+            FOREIGN KEY (user_id, purchase_order_id) REFERENCES purchase_orders (user_id, id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id, product_id) REFERENCES products (user_id, id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS purchase_orders_user_status_idx ON purchase_orders (user_id, status, created_at)",
+        # Open-order quantities per product for the low-stock query
+        "CREATE INDEX IF NOT EXISTS purchase_order_lines_product_idx ON purchase_order_lines (product_id, purchase_order_id)",
+    ]),
+    (9, "add sign-in sessions", [
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL,
+            revoked_at TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS sessions_user_expires_idx ON sessions (user_id, expires_at)",
+    ]),
+    # inventory_logs_YYYYMM could be mistaken for a legacy per-user table
+    # (inventory_logs_<user_id>), so partitions move to inventory_logs_pYYYYMM
+    (10, "rename inventory_logs partitions", [
+        """
+        DO $$
+        DECLARE
+            part RECORD;
+        BEGIN
+            FOR part IN
+                SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'inventory_logs'::regclass AND c.relname ~ '^inventory_logs_[0-9]{6}$'
+            LOOP
+                EXECUTE format('ALTER TABLE %I RENAME TO %I', part.relname,
+                               'inventory_logs_p' || substr(part.relname, 16));
+            END LOOP;
+        END
+        $$
+        """,
+        """
+        CREATE OR REPLACE FUNCTION create_inventory_log_partitions(from_month TIMESTAMP, to_month TIMESTAMP)
+        RETURNS INTEGER LANGUAGE plpgsql AS $$
+        DECLARE
+            month_start TIMESTAMP := date_trunc('month', from_month);
+            part_name TEXT;
+            created INTEGER := 0;
+        BEGIN
+            WHILE month_start <= to_month LOOP
+                part_name := 'inventory_logs_p' || to_char(month_start, 'YYYYMM');
+                IF to_regclass(part_name) IS NULL THEN
+                    LOCK TABLE inventory_logs_default IN EXCLUSIVE MODE;
+                    EXECUTE format('CREATE TABLE %I (LIKE inventory_logs INCLUDING DEFAULTS)', part_name);
+                    EXECUTE format($sql$
+                        WITH moved AS (
+                            DELETE FROM inventory_logs_default
+                            WHERE timestamp >= %L AND timestamp < %L
+                            RETURNING *
+                        )
+                        INSERT INTO %I SELECT * FROM moved
+                    $sql$, month_start, month_start + interval '1 month', part_name);
+                    EXECUTE format('ALTER TABLE inventory_logs ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                                   part_name, month_start, month_start + interval '1 month');
+                    created := created + 1;
+                END IF;
+                month_start := month_start + interval '1 month';
+            END LOOP;
+            RETURN created;
+        END
+        $$
+        """,
+    ]),
+    # Same tenant, phone and text on the same day is queued once; failed
+    # rows leave the index so they can be queued again
+    (11, "deduplicate queued messages", [
+        "ALTER TABLE message_outbox ADD COLUMN IF NOT EXISTS dedupe_key TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS message_outbox_dedupe_idx ON message_outbox (user_id, dedupe_key) WHERE status <> 'failed'",
+    ]),
+]
+
+# Tables holding per-tenant rows, keyed by user_id
+TENANT_TABLES = ("suppliers", "products", "inventory_logs", "whatsapp_templates")
+
+# Rows copied per statement when moving legacy per-user tables
+LEGACY_MIGRATION_BATCH_SIZE = int(os.getenv("LEGACY_MIGRATION_BATCH_SIZE", "5000"))
 
 # Database initialization
-def init_main_database():
-    """Initialize the main users database"""
-    conn = get_connection()
-    try:
+def apply_migrations(scope, migrations, **params):
+    """Apply the pending migrations of ``scope`` in a single transaction.
+
+    An advisory lock serialises concurrent processes, so each version is
+    applied exactly once. Returns the list of versions applied.
+    """
+    with get_connection() as conn:
         cur = conn.cursor()
-        
-        # Create users table in main database
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext('schema_migrations'))")
         cur.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                name TEXT NOT NULL,
-                phone TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                scope TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (scope, version)
             )
         """)
+        cur.execute("SELECT version FROM schema_migrations WHERE scope = %s", (scope,))
+        applied = {row[0] for row in cur.fetchall()}
         
+        pending = [m for m in migrations if m[0] not in applied]
+        for version, description, statements in pending:
+            for statement in statements:
+                cur.execute(statement.format(**params) if params else statement)
+            cur.execute(
+                "INSERT INTO schema_migrations (scope, version, description) VALUES (%s, %s, %s)",
+                (scope, version, description)
+            )
         conn.commit()
-        
-        # Create default admin user if no users exist
-        cur.execute("SELECT COUNT(*) FROM users")
-        if cur.fetchone()[0] == 0:
-            hashed_pw = hash_password("admin123")
+        return [m[0] for m in pending]
+
+@st.cache_resource(show_spinner=False)
+def init_main_database():
+    """Migrate the main database and seed the admin user, once per process"""
+    apply_migrations("main", MIGRATIONS)
+    
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT EXISTS (SELECT 1 FROM users)")
+        has_users = cur.fetchone()[0]
+    
+    # Create default admin user if no users exist, hashing outside the connection
+    if not has_users:
+        hashed_pw = hash_password("admin123")
+        with get_connection() as conn:
+            cur = conn.cursor()
             cur.execute(
-                "INSERT INTO users (name, phone, password_hash) VALUES (%s, %s, %s)",
+                "INSERT INTO users (name, phone, password_hash) VALUES (%s, %s, %s) ON CONFLICT (phone) DO NOTHING",
                 ("Admin User", "admin", hashed_pw)
             )
             conn.commit()
-        
-    except Exception as e:
-        st.error(f"Main database initialization error: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
+    
+    create_inventory_log_partitions()
+    return True
 
-def init_user_database(user_id):
-    """Initialize database for a specific user"""
-    conn = get_connection()
-    try:
+def find_legacy_tenants():
+    """Ids of users that still have per-user tables (products_<id>, ...)"""
+    with get_connection() as conn:
         cur = conn.cursor()
-        
-        # Create suppliers table
-        cur.execute(f"""
-            CREATE TABLE IF NOT EXISTS suppliers_{user_id} (
-                id SERIAL PRIMARY KEY,
-                name TEXT NOT NULL,
-                contact_number TEXT NOT NULL,
-                email TEXT,
-                address TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
+        cur.execute("""
+            SELECT u.id FROM users u
+            WHERE to_regclass('products_' || u.id) IS NOT NULL
+              AND NOT EXISTS (
+                  SELECT 1 FROM schema_migrations m WHERE m.scope = 'legacy:' || u.id
+              )
+            ORDER BY u.id
         """)
+        return [row[0] for row in cur.fetchall()]
+
+def _copy_legacy_rows(cur, source, insert_sql, batch_size):
+    # Copy in id ranges so no single statement has to move a whole table
+    cur.execute(sql.SQL("SELECT MIN(id), MAX(id) FROM {}").format(sql.Identifier(source)))
+    low, high = cur.fetchone()
+    copied = 0
+    while low is not None and low <= high:
+        cur.execute(insert_sql, {"low": low, "high": low + batch_size - 1})
+        copied += cur.rowcount
+        low += batch_size
+    return copied
+
+def migrate_legacy_tenant(user_id, batch_size=LEGACY_MIGRATION_BATCH_SIZE, drop_legacy=False):
+    """Copy a user's per-user tables into the shared tenant tables.
+
+    Runs in one transaction and is recorded in schema_migrations as
+    ``legacy:<user_id>``, so it is safe to call repeatedly. Old ids are
+    remapped through temporary tables because the shared tables draw ids
+    from a single sequence. Returns rows copied per table, or None if there
+    was nothing to migrate.
+    """
+    scope = f"legacy:{user_id}"
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (scope,))
+        cur.execute("SELECT 1 FROM schema_migrations WHERE scope = %s", (scope,))
+        if cur.fetchone():
+            return None
         
-        # Create products table
-        cur.execute(f"""
-            CREATE TABLE IF NOT EXISTS products_{user_id} (
-                id SERIAL PRIMARY KEY,
-                name TEXT NOT NULL,
-                supplier_id INTEGER REFERENCES suppliers_{user_id}(id),
-                quantity INTEGER NOT NULL DEFAULT 0,
-                min_threshold INTEGER NOT NULL DEFAULT 10,
-                unit_price DECIMAL(10,2),
-                category TEXT,
-                description TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        legacy = {}
+        for table in TENANT_TABLES:
+            cur.execute("SELECT EXISTS (SELECT 1 FROM pg_class WHERE oid = to_regclass(%s) AND NOT relispartition)",
+                        (f"{table}_{user_id}",))
+            if cur.fetchone()[0]:
+                legacy[table] = f"{table}_{user_id}"
+        if "products" not in legacy:
+            return None
         
-        # Create inventory_logs table
-        cur.execute(f"""
-            CREATE TABLE IF NOT EXISTS inventory_logs_{user_id} (
-                id SERIAL PRIMARY KEY,
-                product_id INTEGER REFERENCES products_{user_id}(id),
-                action TEXT NOT NULL,
-                quantity_change INTEGER NOT NULL,
-                previous_quantity INTEGER NOT NULL,
-                new_quantity INTEGER NOT NULL,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        # Map legacy ids to ids drawn from the shared tables' sequences
+        params = {"user_id": sql.Literal(user_id)}
+        for table in ("suppliers", "products"):
+            id_map = params[f"{table}_map"] = sql.Identifier(f"legacy_{table}_ids")
+            cur.execute(sql.SQL(
+                "CREATE TEMP TABLE {} (old_id INTEGER PRIMARY KEY, new_id INTEGER NOT NULL) ON COMMIT DROP"
+            ).format(id_map))
+            if table in legacy:
+                params[table] = sql.Identifier(legacy[table])
+                cur.execute(sql.SQL(
+                    "INSERT INTO {} SELECT id, nextval(pg_get_serial_sequence(%s, 'id')) FROM {}"
+                ).format(id_map, params[table]), (table,))
         
-        # Create WhatsApp templates table
-        cur.execute(f"""
-            CREATE TABLE IF NOT EXISTS whatsapp_templates_{user_id} (
-                id SERIAL PRIMARY KEY,
-                name TEXT NOT NULL,
-                template_text TEXT NOT NULL,
-                is_default BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        copied = {}
+        if "suppliers" in legacy:
+            copied["suppliers"] = _copy_legacy_rows(cur, legacy["suppliers"], sql.SQL("""
+                INSERT INTO suppliers (id, user_id, name, contact_number, email, address, created_at)
+                SELECT m.new_id, {user_id}, s.name, s.contact_number, s.email, s.address, s.created_at
+                FROM {suppliers} s JOIN {suppliers_map} m ON m.old_id = s.id
+                WHERE s.id BETWEEN %(low)s AND %(high)s
+            """).format(**params), batch_size)
+        copied["products"] = _copy_legacy_rows(cur, legacy["products"], sql.SQL("""
+            INSERT INTO products (id, user_id, name, supplier_id, quantity, min_threshold, unit_price,
+                                  category, description, created_at, updated_at)
+            SELECT m.new_id, {user_id}, p.name, sm.new_id, p.quantity, p.min_threshold, p.unit_price,
+                   p.category, p.description, p.created_at, p.updated_at
+            FROM {products} p
+            JOIN {products_map} m ON m.old_id = p.id
+            LEFT JOIN {suppliers_map} sm ON sm.old_id = p.supplier_id
+            WHERE p.id BETWEEN %(low)s AND %(high)s
+        """).format(**params), batch_size)
+        if "inventory_logs" in legacy:
+            # Give old months their own partitions so the copy doesn't land in the default one
+            _partition_months_of(cur, legacy["inventory_logs"])
+            copied["inventory_logs"] = _copy_legacy_rows(cur, legacy["inventory_logs"], sql.SQL("""
+                INSERT INTO inventory_logs (user_id, product_id, action, quantity_change,
+                                            previous_quantity, new_quantity, timestamp)
+                SELECT {user_id}, pm.new_id, l.action, l.quantity_change,
+                       l.previous_quantity, l.new_quantity, COALESCE(l.timestamp, CURRENT_TIMESTAMP)
+                FROM {logs} l LEFT JOIN {products_map} pm ON pm.old_id = l.product_id
+                WHERE l.id BETWEEN %(low)s AND %(high)s
+            """).format(logs=sql.Identifier(legacy["inventory_logs"]), **params), batch_size)
+        if "whatsapp_templates" in legacy:
+            copied["whatsapp_templates"] = _copy_legacy_rows(cur, legacy["whatsapp_templates"], sql.SQL("""
+                INSERT INTO whatsapp_templates (user_id, name, template_text, is_default, created_at)
+                SELECT {user_id}, t.name, t.template_text, t.is_default, t.created_at
+                FROM {templates} t
+                WHERE t.id BETWEEN %(low)s AND %(high)s
+            """).format(templates=sql.Identifier(legacy["whatsapp_templates"]), **params), batch_size)
         
+        if drop_legacy:
+            cur.execute(sql.SQL("DROP TABLE {}").format(sql.SQL(", ").join(
+                sql.Identifier(legacy[t]) for t in reversed(TENANT_TABLES) if t in legacy
+            )))
+        cur.execute(
+            "INSERT INTO schema_migrations (scope, version, description) VALUES (%s, 1, %s)",
+            (scope, "copy per-user tables into shared tenant tables")
+        )
         conn.commit()
-        
-        # Initialize WhatsApp templates after table creation
-        init_whatsapp_templates(user_id)
-        
-    except Exception as e:
-        st.error(f"User database initialization error: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
+    invalidate_user_cache(user_id)
+    return copied
+
+def enable_tenant_rls():
+    """Turn on row-level security for the shared tenant tables.
+
+    Policies filter on the ``app.user_id`` setting. The table owner (the
+    app's own role) bypasses RLS, so this restricts other roles, such as
+    reporting users, that must ``SET app.user_id`` before querying.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        for table in TENANT_TABLES:
+            cur.execute(sql.SQL("ALTER TABLE {} ENABLE ROW LEVEL SECURITY").format(sql.Identifier(table)))
+            cur.execute(sql.SQL("DROP POLICY IF EXISTS tenant_isolation ON {}").format(sql.Identifier(table)))
+            cur.execute(sql.SQL("""
+                CREATE POLICY tenant_isolation ON {} USING (user_id = NULLIF(current_setting('app.user_id', true), '')::integer)
+            """).format(sql.Identifier(table)))
+        conn.commit()
+
+def init_user_database(user_id):
+    """Initialize database for a specific user"""
+    # Users created before the shared schema keep their rows in per-user tables
+    migrate_legacy_tenant(user_id)
+    
+    # Seed the default WhatsApp templates
+    init_whatsapp_templates(user_id)
+
+@st.cache_resource(show_spinner=False)
+def ensure_user_database(user_id):
+    """Run init_user_database once per process for a signed-in user"""
+    init_user_database(user_id)
+    return True
+
+# Password hashing runs in a small process pool so bcrypt can't take every core
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", "2"))
+
+# Sign-in throttling, per client address: password checks per minute, and a
+# lockout for a client that keeps failing on the same phone number
+LOGIN_RATE_PER_MINUTE = int(os.getenv("LOGIN_RATE_PER_MINUTE", "120"))
+LOGIN_MAX_FAILURES = int(os.getenv("LOGIN_MAX_FAILURES", "5"))
+LOGIN_LOCKOUT_SECONDS = int(os.getenv("LOGIN_LOCKOUT_SECONDS", "300"))
+
+@st.cache_resource(show_spinner=False)
+def get_password_executor():
+    # spawn rather than fork: the app process is full of threads
+    return ProcessPoolExecutor(max_workers=PASSWORD_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+class LoginThrottle:
+    """Token buckets for password checks plus a negative cache of failing sign-ins.
+
+    Each client gets its own bucket, so one noisy client can't use up the
+    budget of everyone else. Failures are counted per (client, phone): a
+    pair with ``max_failures`` failures inside ``lockout_seconds`` is refused
+    before the users query or bcrypt run, while the phone's owner signing in
+    from elsewhere is not affected. Only the most recent ``max_entries``
+    clients and pairs are remembered.
+    """
+
+    def __init__(self, rate_per_minute, max_failures, lockout_seconds, max_entries=10000):
+        self._lock = threading.Lock()
+        self.rate = rate_per_minute / 60
+        self.burst = max(1, rate_per_minute // 6)
+        self.max_failures = max_failures
+        self.lockout_seconds = lockout_seconds
+        self.max_entries = max_entries
+        self.buckets = OrderedDict()
+        self.failures = OrderedDict()
+
+    def locked_for(self, client, phone):
+        """Seconds until ``client`` may try ``phone`` again, or 0"""
+        key = (client, phone)
+        with self._lock:
+            count, since = self.failures.get(key, (0, None))
+            if since is None:
+                return 0
+            remaining = self.lockout_seconds - (time.monotonic() - since)
+            if remaining <= 0:
+                del self.failures[key]
+                return 0
+            return remaining if count >= self.max_failures else 0
+
+    def acquire(self, client):
+        """Take a token from ``client``'s bucket for one bcrypt call; returns 0, or seconds until one is free"""
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self.buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0
+            if tokens < 1:
+                wait = (1 - tokens) / self.rate
+            else:
+                tokens -= 1
+            self.buckets[client] = (tokens, now)
+            while len(self.buckets) > self.max_entries:
+                self.buckets.popitem(last=False)
+            return wait
+
+    def record_failure(self, client, phone):
+        key = (client, phone)
+        with self._lock:
+            count, since = self.failures.pop(key, (0, time.monotonic()))
+            self.failures[key] = (count + 1, since)
+            while len(self.failures) > self.max_entries:
+                self.failures.popitem(last=False)
+
+    def record_success(self, client, phone):
+        with self._lock:
+            self.failures.pop((client, phone), None)
+
+@st.cache_resource(show_spinner=False)
+def get_login_throttle():
+    return LoginThrottle(LOGIN_RATE_PER_MINUTE, LOGIN_MAX_FAILURES, LOGIN_LOCKOUT_SECONDS)
+
+def client_address():
+    """Address of the browser behind the current rerun, or None outside one"""
+    return st.context.ip_address
+
+def check_login_lockout(client, phone):
+    """Raise ValueError while ``client`` is locked out of ``phone``; costs no budget"""
+    wait = get_login_throttle().locked_for(client, phone)
+    if wait:
+        raise ValueError(f"Too many failed sign-ins for this number. Try again in {math.ceil(wait / 60)} minute(s).")
+
+def throttle_password_check(client):
+    """Raise ValueError when ``client`` is out of bcrypt budget, else spend one check"""
+    wait = get_login_throttle().acquire(client)
+    if wait:
+        raise ValueError(f"Too many sign-in attempts right now. Try again in {math.ceil(wait)} second(s).")
 
 # Authentication functions
 def hash_password(password):
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    hashed = get_password_executor().submit(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(BCRYPT_ROUNDS))
+    return hashed.result().decode('utf-8')
 
 def verify_password(password, hashed):
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    return get_password_executor().submit(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8')).result()
+
+def password_needs_rehash(hashed):
+    """Whether ``hashed`` was made with a cost other than BCRYPT_ROUNDS ($2b$<cost>$...)"""
+    return int(hashed.split("$")[2]) != BCRYPT_ROUNDS
 
 def register_user(name, phone, password):
-    conn = get_connection()
+    throttle_password_check(client_address())
+    # Hash before borrowing a connection so bcrypt doesn't hold it
+    hashed_pw = hash_password(password)
+    with get_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                "INSERT INTO users (name, phone, password_hash) VALUES (%s, %s, %s) RETURNING id",
+                (name, phone, hashed_pw)
+            )
+            user_id = cur.fetchone()[0]
+            conn.commit()
+        except psycopg2.IntegrityError:
+            return None
+    
+    # Initialize user's personal database
     try:
-        cur = conn.cursor()
-        hashed_pw = hash_password(password)
-        cur.execute(
-            "INSERT INTO users (name, phone, password_hash) VALUES (%s, %s, %s) RETURNING id",
-            (name, phone, hashed_pw)
-        )
-        user_id = cur.fetchone()[0]
-        conn.commit()
-        
-        # Initialize user's personal database
         init_user_database(user_id)
-        return user_id
-    except psycopg2.IntegrityError:
-        return None
-    finally:
-        conn.close()
+    except Exception as e:
+        st.error(f"User database initialization error: {e}")
+    return user_id
 
 def login_user(phone, password):
-    conn = get_connection()
-    try:
+    """User dict for valid credentials, else None; raises ValueError while throttled"""
+    client = client_address()
+    check_login_lockout(client, phone)
+    with get_connection() as conn:
         cur = conn.cursor()
         cur.execute("SELECT id, name, password_hash FROM users WHERE phone = %s", (phone,))
         user = cur.fetchone()
-        if user and verify_password(password, user[2]):
-            return {"id": user[0], "name": user[1]}
+    
+    # Only a bcrypt check spends budget; unknown numbers fail without one
+    if user:
+        throttle_password_check(client)
+    # Verify outside the pooled connection so bcrypt doesn't hold it
+    if not user or not verify_password(password, user[2]):
+        get_login_throttle().record_failure(client, phone)
         return None
-    finally:
-        conn.close()
+    
+    get_login_throttle().record_success(client, phone)
+    # Move the hash to the configured cost the next time the password is known
+    if password_needs_rehash(user[2]):
+        rehashed = hash_password(password)
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("UPDATE users SET password_hash = %s WHERE id = %s", (rehashed, user[0]))
+            conn.commit()
+    return {"id": user[0], "name": user[1], "phone": phone}
+
+# Signed session tokens, carried in the URL (?session=...) so a refresh or
+# reconnect restores the sign-in without a bcrypt check. Because a URL gets
+# copied and logged, expiry lives server-side: a session lapses after
+# SESSION_TTL_HOURS without use and SESSION_MAX_HOURS after sign-in.
+SESSION_SECRET = os.getenv("SESSION_SECRET", "")
+SESSION_TTL_HOURS = float(os.getenv("SESSION_TTL_HOURS", "8"))
+SESSION_MAX_HOURS = float(os.getenv("SESSION_MAX_HOURS", "24"))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+# How long a validated token is trusted before the sessions row is checked
+# (and its expiry pushed out) again, i.e. how late another app process
+# notices a logout
+SESSION_CACHE_SECONDS = float(os.getenv("SESSION_CACHE_SECONDS", "60"))
+
+@st.cache_resource(show_spinner=False)
+def get_session_secret():
+    if SESSION_SECRET:
+        return SESSION_SECRET.encode('utf-8')
+    logger.warning("SESSION_SECRET is not set; sign-in sessions will not survive a restart")
+    return secrets.token_bytes(32)
+
+class SessionCache:
+    """LRU of validated tokens mapped to their user dicts.
+
+    Entries expire after ``ttl`` seconds so revocations made by other
+    processes are picked up; local revocations discard the entry at once.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            stored_at, user = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return dict(user)
+
+    def set(self, token, user):
+        with self._lock:
+            self._entries[token] = (time.monotonic(), dict(user))
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, token):
+        with self._lock:
+            self._entries.pop(token, None)
+
+@st.cache_resource(show_spinner=False)
+def get_session_cache():
+    return SessionCache(SESSION_CACHE_SIZE, SESSION_CACHE_SECONDS)
+
+def _sign_session(session_id, user_id):
+    payload = f"{session_id}.{user_id}".encode('utf-8')
+    return hmac.new(get_session_secret(), payload, hashlib.sha256).hexdigest()
+
+def _parse_session_token(token):
+    """``(session_id, user_id)`` of a well-formed, correctly signed token, else None"""
+    parts = token.split(".")
+    # Anything that is not ASCII digits and 64 hex characters is rejected up
+    # front; compare_digest raises on non-ASCII str
+    if len(parts) != 3 or not re.fullmatch(r"[0-9]+", parts[1]) or not re.fullmatch(r"[0-9a-f]{64}", parts[2]):
+        return None
+    session_id, user_id, signature = parts
+    if not hmac.compare_digest(signature.encode('ascii'), _sign_session(session_id, user_id).encode('ascii')):
+        return None
+    return session_id, int(user_id)
+
+def create_session(user):
+    """Record a session for a signed-in user and return its token"""
+    session_id = secrets.token_urlsafe(16)
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM sessions WHERE user_id = %s AND expires_at < LOCALTIMESTAMP", (user["id"],))
+        cur.execute("""
+            INSERT INTO sessions (id, user_id, created_at, expires_at)
+            VALUES (%s, %s, LOCALTIMESTAMP, LOCALTIMESTAMP + make_interval(secs => %s))
+        """, (session_id, user["id"], min(SESSION_TTL_HOURS, SESSION_MAX_HOURS) * 3600))
+        conn.commit()
+    token = f"{session_id}.{user['id']}.{_sign_session(session_id, user['id'])}"
+    get_session_cache().set(token, user)
+    return token
+
+def validate_session_token(token):
+    """User dict for a valid, unexpired, unrevoked token, else None.
+
+    Each check against the sessions row slides its expiry SESSION_TTL_HOURS
+    ahead, up to SESSION_MAX_HOURS after sign-in.
+    """
+    parsed = _parse_session_token(token)
+    if parsed is None:
+        return None
+    
+    cache = get_session_cache()
+    user = cache.get(token)
+    if user is not None:
+        return user
+    
+    session_id, user_id = parsed
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE sessions s
+            SET expires_at = LEAST(LOCALTIMESTAMP + make_interval(secs => %s),
+                                   s.created_at + make_interval(secs => %s))
+            FROM users u
+            WHERE u.id = s.user_id AND s.id = %s AND s.user_id = %s
+              AND s.revoked_at IS NULL AND s.expires_at > LOCALTIMESTAMP
+            RETURNING u.id, u.name, u.phone
+        """, (SESSION_TTL_HOURS * 3600, SESSION_MAX_HOURS * 3600, session_id, user_id))
+        row = cur.fetchone()
+        conn.commit()
+    if row is None:
+        return None
+    user = {"id": row[0], "name": row[1], "phone": row[2]}
+    cache.set(token, user)
+    return user
+
+def revoke_session(token):
+    """End the session behind ``token``; tokens that fail the signature check are ignored"""
+    parsed = _parse_session_token(token)
+    if parsed is None:
+        return
+    get_session_cache().discard(token)
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE sessions SET revoked_at = LOCALTIMESTAMP WHERE id = %s AND revoked_at IS NULL", (parsed[0],))
+        conn.commit()
 
 # Supplier CRUD operations
 def add_supplier(name, contact_number, email, address, user_id):
-    conn = get_connection()
-    try:
+    with get_connection() as conn:
         cur = conn.cursor()
         cur.execute(
-            f"INSERT INTO suppliers_{user_id} (name, contact_number, email, address) VALUES (%s, %s, %s, %s) RETURNING id",
-            (name, contact_number, email, address)
+            "INSERT INTO suppliers (user_id, name, contact_number, email, address) VALUES (%s, %s, %s, %s, %s) RETURNING id",
+            (user_id, name, contact_number, email, address)
         )
         supplier_id = cur.fetchone()[0]
         conn.commit()
+        invalidate_user_cache(user_id)
         return supplier_id
-    finally:
-        conn.close()
 
+@cached_query("suppliers")
 def get_suppliers(user_id):
-    conn = get_connection()
-    try:
+    with get_connection() as conn:
         cur = conn.cursor()
-        cur.execute(f"SELECT id, name, contact_number, email, address FROM suppliers_{user_id} ORDER BY name")
+        cur.execute("SELECT id, name, contact_number, email, address FROM suppliers WHERE user_id = %s ORDER BY name", (user_id,))
         return cur.fetchall()
-    finally:
-        conn.close()
 
 def update_supplier(supplier_id, name, contact_number, email, address, user_id):
-    conn = get_connection()
-    try:
+    with get_connection() as conn:
         cur = conn.cursor()
         cur.execute(
-            f"UPDATE suppliers_{user_id} SET name = %s, contact_number = %s, email = %s, address = %s WHERE id = %s",
-            (name, contact_number, email, address, supplier_id)
+            "UPDATE suppliers SET name = %s, contact_number = %s, email = %s, address = %s WHERE id = %s AND user_id = %s",
+            (name, contact_number, email, address, supplier_id, user_id)
         )
         conn.commit()
-    finally:
-        conn.close()
+        invalidate_user_cache(user_id)
 
 def delete_supplier(supplier_id, user_id):
-    conn = get_connection()
-    try:
+    with get_connection() as conn:
         cur = conn.cursor()
-        cur.execute(f"DELETE FROM suppliers_{user_id} WHERE id = %s", (supplier_id,))
+        cur.execute("DELETE FROM suppliers WHERE id = %s AND user_id = %s", (supplier_id, user_id))
         conn.commit()
-    finally:
-        conn.close()
+        invalidate_user_cache(user_id)
 
 # Product CRUD operations
 def add_product(name, supplier_id, quantity, min_threshold, unit_price, category, description, user_id):
-    conn = get_connection()
-    try:
+    with get_connection() as conn:
         cur = conn.cursor()
         cur.execute(
-            f"INSERT INTO products_{user_id} (name, supplier_id, quantity, min_threshold, unit_price, category, description) VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id",
-            (name, supplier_id, quantity, min_threshold, unit_price, category, description)
+            "INSERT INTO products (user_id, name, supplier_id, quantity, min_threshold, unit_price, category, description) VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id",
+            (user_id, name, supplier_id, quantity, min_threshold, unit_price, category, description)
         )
         product_id = cur.fetchone()[0]
+        # Same transaction and connection as the insert; never check out a second one
+        _log_inventory_change(cur, product_id, "ADD", quantity, 0, quantity, user_id)
         conn.commit()
-        log_inventory_change(product_id, "ADD", quantity, 0, quantity, user_id)
+        invalidate_user_cache(user_id)
         return product_id
-    finally:
-        conn.close()
 
+@cached_query("products")
 def get_products(user_id):
-    conn = get_connection()
-    try:
+    with get_connection() as conn:
         cur = conn.cursor()
-        cur.execute(f"""
+        cur.execute("""
             SELECT p.id, p.name, s.name as supplier_name, p.quantity, p.min_threshold, 
                    p.unit_price, p.category, p.description, s.contact_number
-            FROM products_{user_id} p 
-            LEFT JOIN suppliers_{user_id} s ON p.supplier_id = s.id 
+            FROM products p 
+            LEFT JOIN suppliers s ON p.supplier_id = s.id 
+            WHERE p.user_id = %s
             ORDER BY p.name
-        """)
+        """, (user_id,))
         return cur.fetchall()
-    finally:
-        conn.close()
+
+# Rows per page in the product browser
+PRODUCT_PAGE_SIZE = int(os.getenv("PRODUCT_PAGE_SIZE", "25"))
+
+@cached_query("products_page")
+def get_products_page(user_id, after=None, limit=PRODUCT_PAGE_SIZE, category=None, supplier_id=None, low_stock_only=False):
+    """Fetch one page of products ordered by (name, id).
+
+    ``after`` is the ``(name, id)`` of the previous page's last row (keyset
+    pagination), so every page costs the same regardless of depth. Rows are
+    ``(id, name, supplier_name, quantity, min_threshold, unit_price,
+    category)``. Returns ``(rows, next_cursor)``, where next_cursor is None
+    on the last page.
+    """
+    conditions = ["p.user_id = %(user_id)s"]
+    if after:
+        conditions.append("(p.name, p.id) > (%(after_name)s, %(after_id)s)")
+    if category:
+        conditions.append("p.category = %(category)s")
+    if supplier_id:
+        conditions.append("p.supplier_id = %(supplier_id)s")
+    if low_stock_only:
+        conditions.append("p.quantity <= p.min_threshold")
+    
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT p.id, p.name, s.name as supplier_name, p.quantity, p.min_threshold, p.unit_price, p.category
+            FROM products p
+            LEFT JOIN suppliers s ON p.supplier_id = s.id
+            WHERE {" AND ".join(conditions)}
+            ORDER BY p.name, p.id
+            LIMIT %(limit)s
+        """, {
+            "user_id": user_id,
+            "after_name": after[0] if after else None,
+            "after_id": after[1] if after else None,
+            "category": category,
+            "supplier_id": supplier_id,
+            "limit": limit + 1,
+        })
+        rows = cur.fetchall()
+    
+    # One extra row tells us whether another page exists
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, (rows[-1][1], rows[-1][0])
+    return rows, None
+
+@cached_query("categories")
+def get_product_categories(user_id):
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT DISTINCT category FROM products WHERE user_id = %s AND category IS NOT NULL AND category <> '' ORDER BY category",
+            (user_id,)
+        )
+        return [row[0] for row in cur.fetchall()]
+
+# Rows loaded into the dashboard's bulk quantity editor
+BULK_EDIT_LIMIT = int(os.getenv("BULK_EDIT_LIMIT", "500"))
+
+@cached_query("dashboard_summary")
+def get_dashboard_summary(user_id):
+    """Metric-card numbers and per-category counts/values.
+
+    Reads the trigger-maintained inventory_summary row and its category rows
+    in one round trip, so the cost doesn't grow with the catalog.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT COALESCE(s.product_count, 0), COALESCE(s.total_value, 0),
+                   COALESCE(s.low_stock_count, 0), COALESCE(s.supplier_count, 0),
+                   (SELECT COALESCE(json_agg(json_build_array(category, product_count, total_value)
+                                             ORDER BY product_count DESC, category), '[]')
+                    FROM inventory_category_summary WHERE user_id = %(user_id)s)
+            FROM (SELECT %(user_id)s AS user_id) t
+            LEFT JOIN inventory_summary s ON s.user_id = t.user_id
+        """, {"user_id": user_id})
+        product_count, inventory_value, low_stock_count, supplier_count, categories = cur.fetchone()
+        return {
+            "product_count": product_count,
+            "inventory_value": float(inventory_value),
+            "low_stock_count": low_stock_count,
+            "supplier_count": supplier_count,
+            "categories": [(name, count, float(value)) for name, count, value in categories],
+        }
+
+def load_dashboard_data(user_id):
+    """Everything show_dashboard reads: the summary and the first 8 products"""
+    return get_dashboard_summary(user_id), get_products_page(user_id, limit=8)[0]
+
+def parse_quantity_change(value):
+    """Split a quantity input into ``(amount, is_relative)``.
+
+    Plain numbers set the stock level; strings starting with "+" or "-"
+    (e.g. "+5", "-3") adjust it relative to the current level.
+    """
+    if isinstance(value, str):
+        text = value.strip()
+        return int(text), text[:1] in ("+", "-")
+    return int(value), False
 
 def update_product_quantity(product_id, new_quantity, user_id, action="UPDATE"):
-    conn = get_connection()
-    try:
+    """Atomically set or adjust a product's stock and log the change.
+
+    ``new_quantity`` is an absolute level or a relative delta such as "+5" or
+    "-3". Returns ``(previous_quantity, new_quantity)``, or None if the
+    product doesn't exist or the change would take stock below zero.
+    """
+    applied = apply_stock_adjustments([(product_id, new_quantity, action)], user_id)
+    return applied.get(product_id)
+
+def apply_stock_adjustments(adjustments, user_id):
+    """Apply many quantity changes and their log rows in one transaction.
+
+    ``adjustments`` is an iterable of ``(product_id, quantity, action)`` where
+    quantity follows ``parse_quantity_change``. Returns a dict mapping each
+    applied product id to ``(previous_quantity, new_quantity)``; products that
+    don't exist or would go below zero are left untouched and omitted.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        applied = _apply_stock_adjustments(cur, adjustments, user_id)
+        conn.commit()
+        invalidate_user_cache(user_id)
+        return applied
+
+def _apply_stock_adjustments(cur, adjustments, user_id):
+    # Collapse repeated products so each row is updated once: a delta adds to
+    # the earlier entry (keeping it absolute if it was), an absolute level
+    # replaces it.
+    changes = {}
+    for product_id, quantity, action in adjustments:
+        amount, is_relative = parse_quantity_change(quantity)
+        previous = changes.get(product_id)
+        if previous and is_relative:
+            amount, is_relative = previous[0] + amount, previous[1]
+        changes[product_id] = (amount, is_relative, action)
+    if not changes:
+        return {}
+    
+    # Rows are locked in id order so concurrent batches can't deadlock, and
+    # lock + update + log insert run as a single statement.
+    rows = execute_values(cur, sql.SQL("""
+        WITH changes (product_id, amount, is_relative, action) AS (VALUES %s),
+        locked AS (
+            SELECT id, quantity FROM products
+            WHERE user_id = {user_id} AND id IN (SELECT product_id FROM changes)
+            ORDER BY id
+            FOR UPDATE
+        ), target AS (
+            SELECT l.id, l.quantity AS previous_quantity,
+                   CASE WHEN c.is_relative THEN l.quantity + c.amount ELSE c.amount END AS new_quantity,
+                   c.action
+            FROM locked l JOIN changes c ON c.product_id = l.id
+        ), updated AS (
+            UPDATE products p
+            SET quantity = t.new_quantity, updated_at = CURRENT_TIMESTAMP
+            FROM target t
+            WHERE p.id = t.id AND t.new_quantity >= 0
+            RETURNING p.id, t.previous_quantity, t.new_quantity, t.action
+        )
+        INSERT INTO inventory_logs (user_id, product_id, action, quantity_change, previous_quantity, new_quantity)
+        SELECT {user_id}, id, action, new_quantity - previous_quantity, previous_quantity, new_quantity FROM updated
+        RETURNING product_id, previous_quantity, new_quantity
+    """).format(user_id=sql.Literal(user_id)), [(product_id, *change) for product_id, change in changes.items()],
+        template="(%s::integer, %s::integer, %s::boolean, %s::text)",
+        page_size=len(changes), fetch=True)
+    return {product_id: (previous, new) for product_id, previous, new in rows}
+
+@cached_query("low_stock_by_supplier")
+def get_low_stock_by_supplier(user_id):
+    """Low-stock products grouped by supplier id, most affected supplier first.
+
+    Stock already on open purchase orders counts toward the threshold, so
+    items that have been reordered drop out until the order is closed.
+    Returns ``(supplier_id, supplier_name, contact_number, item_count, items)``
+    where ``items`` is a list of ``(product_id, name, quantity, min_threshold,
+    unit_price, on_order)``. Products without a supplier form one group with
+    id None.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT s.id, s.name, s.contact_number, COUNT(*),
+                   json_agg(json_build_array(p.id, p.name, p.quantity, p.min_threshold, p.unit_price, o.on_order)
+                            ORDER BY p.quantity, p.name)
+            FROM products p
+            CROSS JOIN LATERAL (
+                SELECT COALESCE(SUM(l.quantity), 0) AS on_order
+                FROM purchase_order_lines l
+                JOIN purchase_orders po ON po.id = l.purchase_order_id AND po.status = 'open'
+                WHERE l.product_id = p.id
+            ) o
+            LEFT JOIN suppliers s ON s.user_id = p.user_id AND s.id = p.supplier_id
+            WHERE p.user_id = %s AND p.quantity <= p.min_threshold
+              AND p.quantity + o.on_order <= p.min_threshold
+            GROUP BY s.id, s.name, s.contact_number
+            ORDER BY COUNT(*) DESC, s.name NULLS LAST, s.id
+        """, (user_id,))
+        return [
+            (supplier_id, name, contact, count, [tuple(item) for item in items])
+            for supplier_id, name, contact, count, items in cur.fetchall()
+        ]
+
+# Purchase orders
+def create_purchase_order(supplier_id, items, user_id):
+    """Record an open purchase order for ``items`` (dicts with product_id,
+    quantity and unit_price, as built by the reorder composer). Returns its id.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO purchase_orders (user_id, supplier_id) VALUES (%s, %s) RETURNING id",
+            (user_id, supplier_id)
+        )
+        order_id = cur.fetchone()[0]
+        execute_values(
+            cur,
+            "INSERT INTO purchase_order_lines (user_id, purchase_order_id, product_id, quantity, unit_price) VALUES %s",
+            [(user_id, order_id, item['product_id'], item['quantity'], item.get('unit_price')) for item in items]
+        )
+        conn.commit()
+        invalidate_user_cache(user_id)
+        return order_id
+
+@cached_query("purchase_orders")
+def get_purchase_orders(user_id, status="open", limit=50):
+    """Latest purchase orders with their lines.
+
+    Returns ``(id, supplier_name, status, created_at, closed_at, total_value,
+    lines)`` where ``lines`` is a list of ``(product_id, name, quantity,
+    unit_price, received_quantity)``.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT po.id, s.name, po.status, po.created_at, po.closed_at,
+                   COALESCE(SUM(l.quantity * l.unit_price), 0),
+                   json_agg(json_build_array(l.product_id, p.name, l.quantity, l.unit_price, l.received_quantity)
+                            ORDER BY p.name)
+            FROM purchase_orders po
+            LEFT JOIN suppliers s ON s.user_id = po.user_id AND s.id = po.supplier_id
+            JOIN purchase_order_lines l ON l.purchase_order_id = po.id
+            JOIN products p ON p.user_id = po.user_id AND p.id = l.product_id
+            WHERE po.user_id = %s AND po.status = %s
+            GROUP BY po.id, s.name
+            ORDER BY po.created_at DESC, po.id DESC
+            LIMIT %s
+        """, (user_id, status, limit))
+        return [
+            (order_id, supplier, order_status, created_at, closed_at, float(total), [tuple(line) for line in lines])
+            for order_id, supplier, order_status, created_at, closed_at, total, lines in cur.fetchall()
+        ]
+
+def receive_purchase_order(order_id, user_id, received=None):
+    """Book an open order's goods into stock in one transaction.
+
+    ``received`` maps product id to the quantity that actually arrived and
+    defaults to the ordered quantities. Every line is applied through
+    _apply_stock_adjustments with "RECEIVE" log rows, and the order is
+    closed. Returns the ``{product_id: (previous, new)}`` changes, or None if
+    the order isn't open.
+    """
+    with get_connection() as conn:
         cur = conn.cursor()
-        cur.execute(f"SELECT quantity FROM products_{user_id} WHERE id = %s", (product_id,))
-        old_quantity = cur.fetchone()[0]
+        cur.execute(
+            "SELECT id FROM purchase_orders WHERE id = %s AND user_id = %s AND status = 'open' FOR UPDATE",
+            (order_id, user_id)
+        )
+        if cur.fetchone() is None:
+            conn.rollback()
+            return None
         
-        cur.execute(f"UPDATE products_{user_id} SET quantity = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s", (new_quantity, product_id))
+        cur.execute(
+            "SELECT product_id, quantity FROM purchase_order_lines WHERE purchase_order_id = %s AND user_id = %s",
+            (order_id, user_id)
+        )
+        lines = {product_id: quantity for product_id, quantity in cur.fetchall()}
+        if received is not None:
+            lines = {product_id: max(0, int(received.get(product_id, 0))) for product_id in lines}
+        
+        applied = _apply_stock_adjustments(
+            cur, [(product_id, f"+{quantity}", "RECEIVE") for product_id, quantity in lines.items() if quantity], user_id
+        )
+        execute_values(cur, sql.SQL("""
+            UPDATE purchase_order_lines l SET received_quantity = v.quantity
+            FROM (VALUES %s) AS v(product_id, quantity)
+            WHERE l.purchase_order_id = {order_id} AND l.product_id = v.product_id
+        """).format(order_id=sql.Literal(order_id)), list(lines.items()), template="(%s::integer, %s::integer)")
+        cur.execute(
+            "UPDATE purchase_orders SET status = 'received', closed_at = CURRENT_TIMESTAMP WHERE id = %s",
+            (order_id,)
+        )
+        conn.commit()
+        invalidate_user_cache(user_id)
+        return applied
+
+def cancel_purchase_order(order_id, user_id):
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE purchase_orders SET status = 'cancelled', closed_at = CURRENT_TIMESTAMP WHERE id = %s AND user_id = %s AND status = 'open'",
+            (order_id, user_id)
+        )
+        conn.commit()
+        invalidate_user_cache(user_id)
+
+def log_inventory_change(product_id, action, quantity_change, previous_quantity, new_quantity, user_id):
+    with get_connection() as conn:
+        _log_inventory_change(conn.cursor(), product_id, action, quantity_change, previous_quantity, new_quantity, user_id)
+        conn.commit()
+
+def _log_inventory_change(cur, product_id, action, quantity_change, previous_quantity, new_quantity, user_id):
+    cur.execute(
+        "INSERT INTO inventory_logs (user_id, product_id, action, quantity_change, previous_quantity, new_quantity) VALUES (%s, %s, %s, %s, %s, %s)",
+        (user_id, product_id, action, quantity_change, previous_quantity, new_quantity)
+    )
+
+# Inventory log partitions and retention
+INVENTORY_LOG_RETENTION_MONTHS = int(os.getenv("INVENTORY_LOG_RETENTION_MONTHS", "12"))
+INVENTORY_LOG_MONTHS_AHEAD = int(os.getenv("INVENTORY_LOG_MONTHS_AHEAD", "3"))
+
+def create_inventory_log_partitions(months_ahead=INVENTORY_LOG_MONTHS_AHEAD, since=None):
+    """Make sure monthly partitions exist from this month to ``months_ahead`` out.
+
+    Every month from ``since`` on gets one too, as does every month that has
+    rows in the default partition (back-dated writes, legacy copies); those
+    rows are moved into their month's partition. Returns partitions created.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT create_inventory_log_partitions(
+                LEAST(date_trunc('month', LOCALTIMESTAMP), date_trunc('month', %s::timestamp)),
+                date_trunc('month', LOCALTIMESTAMP) + make_interval(months => %s)
+            )
+        """, (since, months_ahead))
+        created = cur.fetchone()[0]
+        created += _partition_months_of(cur, "inventory_logs_default")
+        conn.commit()
+        return created
+
+def _partition_months_of(cur, source):
+    """Create a partition for each month that has rows in the ``source`` table"""
+    cur.execute(sql.SQL("SELECT DISTINCT date_trunc('month', timestamp) FROM {} WHERE timestamp IS NOT NULL")
+                .format(sql.Identifier(source)))
+    created = 0
+    for (month,) in cur.fetchall():
+        cur.execute("SELECT create_inventory_log_partitions(%s, %s)", (month, month))
+        created += cur.fetchone()[0]
+    return created
+
+def _rollup_inventory_logs(cur, source, cutoff=None):
+    """Fold raw log rows from ``source`` into inventory_log_daily.
+
+    With a ``cutoff`` the rows older than it are deleted as they are rolled
+    up; without one the whole table is read and left for the caller to drop.
+    """
+    if cutoff:
+        expired = sql.SQL("DELETE FROM {} WHERE timestamp < %(cutoff)s RETURNING *").format(sql.Identifier(source))
+    else:
+        expired = sql.SQL("SELECT * FROM {}").format(sql.Identifier(source))
+    cur.execute(sql.SQL("""
+        WITH expired AS ({expired})
+        INSERT INTO inventory_log_daily AS d
+            (user_id, product_id, day, units_in, units_out, net_change, changes, closing_quantity)
+        SELECT user_id, product_id, timestamp::date,
+               SUM(GREATEST(quantity_change, 0)), SUM(GREATEST(-quantity_change, 0)),
+               SUM(quantity_change), COUNT(*),
+               (array_agg(new_quantity ORDER BY timestamp DESC, id DESC))[1]
+        FROM expired
+        WHERE product_id IS NOT NULL
+        GROUP BY user_id, product_id, timestamp::date
+        ON CONFLICT (user_id, day, product_id) DO UPDATE SET
+            units_in = d.units_in + EXCLUDED.units_in,
+            units_out = d.units_out + EXCLUDED.units_out,
+            net_change = d.net_change + EXCLUDED.net_change,
+            changes = d.changes + EXCLUDED.changes,
+            closing_quantity = EXCLUDED.closing_quantity
+    """).format(expired=expired), {"cutoff": cutoff})
+    return cur.rowcount
+
+def expire_inventory_log_partitions(retention_months=INVENTORY_LOG_RETENTION_MONTHS):
+    """Roll up and drop monthly partitions older than ``retention_months``.
+
+    Each partition is summarised into inventory_log_daily and dropped in
+    its own transaction; stray old rows in the default partition are rolled
+    up the same way. Returns the names of the dropped partitions.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT date_trunc('month', LOCALTIMESTAMP) - make_interval(months => %s)
+        """, (retention_months,))
+        cutoff = cur.fetchone()[0]
+        cur.execute("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'inventory_logs'::regclass
+              AND c.relname ~ '^inventory_logs_p[0-9]{6}$' AND c.relname < %s
+            ORDER BY c.relname
+        """, (f"inventory_logs_p{cutoff:%Y%m}",))
+        expired = [row[0] for row in cur.fetchall()]
         conn.commit()
         
-        quantity_change = new_quantity - old_quantity
-        log_inventory_change(product_id, action, quantity_change, old_quantity, new_quantity, user_id)
-    finally:
-        conn.close()
+        for partition in expired:
+            _rollup_inventory_logs(cur, partition)
+            cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(partition)))
+            conn.commit()
+        
+        _rollup_inventory_logs(cur, "inventory_logs_default", cutoff)
+        conn.commit()
+        return expired
 
-def get_low_stock_products(user_id):
-    conn = get_connection()
-    try:
+# Inventory movement analytics, aggregated in SQL over inventory_logs
+HISTORY_BUCKETS = ("day", "week", "month")
+
+# Raw log rows plus the daily rollups of expired partitions, in one shape.
+# Rolled-up months have no raw rows left, so the two sides never overlap.
+MOVEMENTS_SQL = """
+    SELECT product_id, timestamp, GREATEST(quantity_change, 0) AS units_in,
+           GREATEST(-quantity_change, 0) AS units_out, quantity_change AS net_change, 1 AS changes
+    FROM inventory_logs
+    WHERE user_id = %(user_id)s AND timestamp >= %(start)s AND timestamp < {end}
+    UNION ALL
+    SELECT product_id, day::timestamp, units_in, units_out, net_change, changes
+    FROM inventory_log_daily
+    WHERE user_id = %(user_id)s AND day >= %(start)s AND day < {end}
+"""
+
+def _history_params(user_id, start, end, **extra):
+    """Query parameters for an inclusive [start, end] date range"""
+    return {
+        "user_id": user_id,
+        "start": datetime.combine(start, datetime.min.time()),
+        "end": datetime.combine(end + timedelta(days=1), datetime.min.time()),
+        "days": (end - start).days + 1,
+        **extra,
+    }
+
+@cached_query("stock_history")
+def get_stock_history(user_id, start, end, bucket="day", product_id=None):
+    """Units in/out and closing stock level per bucket between two dates.
+
+    Buckets with no movement are filled in by generate_series. The opening
+    level is the current stock minus every change since ``start``; a running
+    window sum of each bucket's net change gives the level after it.
+    Returns ``(bucket_start, units_in, units_out, net_change, stock_level)``.
+    """
+    if bucket not in HISTORY_BUCKETS:
+        raise ValueError(f"Unknown bucket '{bucket}'")
+    params = _history_params(user_id, start, end, bucket=bucket, product_id=product_id)
+    with get_connection() as conn:
         cur = conn.cursor()
-        cur.execute(f"""
-            SELECT p.id, p.name, s.name as supplier_name, p.quantity, p.min_threshold, s.contact_number
-            FROM products_{user_id} p 
-            LEFT JOIN suppliers_{user_id} s ON p.supplier_id = s.id 
-            WHERE p.quantity <= p.min_threshold
-            ORDER BY p.quantity ASC
-        """)
+        cur.execute("""
+            WITH movements AS (
+                SELECT date_trunc(%(bucket)s, timestamp) AS bucket,
+                       SUM(units_in) AS units_in, SUM(units_out) AS units_out, SUM(net_change) AS net_change
+                FROM ({range_movements}) m
+                WHERE %(product_id)s::integer IS NULL OR product_id = %(product_id)s
+                GROUP BY 1
+            ),
+            opening AS (
+                SELECT (SELECT COALESCE(SUM(quantity), 0) FROM products
+                        WHERE user_id = %(user_id)s
+                          AND (%(product_id)s::integer IS NULL OR id = %(product_id)s))
+                     - (SELECT COALESCE(SUM(net_change), 0) FROM ({later_movements}) m
+                        WHERE %(product_id)s::integer IS NULL OR product_id = %(product_id)s) AS level
+            )
+            SELECT b.bucket::date,
+                   COALESCE(m.units_in, 0), COALESCE(m.units_out, 0), COALESCE(m.net_change, 0),
+                   o.level + SUM(COALESCE(m.net_change, 0)) OVER (ORDER BY b.bucket)
+            FROM generate_series(date_trunc(%(bucket)s, %(start)s::timestamp),
+                                 %(end)s::timestamp - interval '1 second',
+                                 ('1 ' || %(bucket)s)::interval) AS b(bucket)
+            CROSS JOIN opening o
+            LEFT JOIN movements m ON m.bucket = b.bucket
+            ORDER BY b.bucket
+        """.format(range_movements=MOVEMENTS_SQL.format(end="%(end)s"),
+                   later_movements=MOVEMENTS_SQL.format(end="'infinity'")), params)
         return cur.fetchall()
-    finally:
-        conn.close()
 
-def log_inventory_change(product_id, action, quantity_change, previous_quantity, new_quantity, user_id):
-    conn = get_connection()
-    try:
+@cached_query("top_movers")
+def get_top_movers(user_id, start, end, limit=10):
+    """Products with the most units moved in the range.
+
+    Returns ``(rank, product_id, name, category, units_moved, units_in,
+    units_out, changes, share_pct)``; the share is of all units moved.
+    """
+    params = _history_params(user_id, start, end, limit=limit)
+    with get_connection() as conn:
         cur = conn.cursor()
-        cur.execute(
-            f"INSERT INTO inventory_logs_{user_id} (product_id, action, quantity_change, previous_quantity, new_quantity) VALUES (%s, %s, %s, %s, %s)",
-            (product_id, action, quantity_change, previous_quantity, new_quantity)
-        )
+        cur.execute("""
+            WITH moves AS (
+                SELECT product_id,
+                       SUM(units_in + units_out) AS units_moved,
+                       SUM(units_in) AS units_in,
+                       SUM(units_out) AS units_out,
+                       SUM(changes) AS changes
+                FROM ({movements}) m
+                GROUP BY product_id
+            )
+            SELECT RANK() OVER (ORDER BY m.units_moved DESC), p.id, p.name, p.category,
+                   m.units_moved, m.units_in, m.units_out, m.changes,
+                   ROUND(100.0 * m.units_moved / NULLIF(SUM(m.units_moved) OVER (), 0), 1)
+            FROM moves m
+            JOIN products p ON p.user_id = %(user_id)s AND p.id = m.product_id
+            ORDER BY m.units_moved DESC, p.name
+            LIMIT %(limit)s
+        """.format(movements=MOVEMENTS_SQL.format(end="%(end)s")), params)
+        return cur.fetchall()
+
+@cached_query("consumption_rates")
+def get_consumption_rates(user_id, start, end, limit=20):
+    """Fastest-consumed products and how long current stock will last.
+
+    Returns ``(product_id, name, quantity, units_out, daily_rate,
+    days_of_cover)`` ordered by average units used per day over the range.
+    """
+    params = _history_params(user_id, start, end, limit=limit)
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            WITH usage AS (
+                SELECT product_id, SUM(units_out) AS units_out
+                FROM ({movements}) m
+                GROUP BY product_id
+                HAVING SUM(units_out) > 0
+            )
+            SELECT p.id, p.name, p.quantity, u.units_out,
+                   ROUND(u.units_out::numeric / %(days)s, 2) AS daily_rate,
+                   ROUND(p.quantity * %(days)s::numeric / u.units_out, 1)
+            FROM usage u
+            JOIN products p ON p.user_id = %(user_id)s AND p.id = u.product_id
+            ORDER BY daily_rate DESC, p.name
+            LIMIT %(limit)s
+        """.format(movements=MOVEMENTS_SQL.format(end="%(end)s")), params)
+        return cur.fetchall()
+
+# Reorder suggestions from smoothed recent demand
+REORDER_LOOKBACK_DAYS = int(os.getenv("REORDER_LOOKBACK_DAYS", "90"))
+REORDER_SMOOTHING = float(os.getenv("REORDER_SMOOTHING", "0.2"))
+REORDER_LEAD_TIME_DAYS = int(os.getenv("REORDER_LEAD_TIME_DAYS", "7"))
+REORDER_COVER_DAYS = int(os.getenv("REORDER_COVER_DAYS", "14"))
+REORDER_SAFETY_FACTOR = float(os.getenv("REORDER_SAFETY_FACTOR", "1.65"))
+
+@cached_query("demand_forecast")
+def get_demand_forecast(user_id, lookback_days=REORDER_LOOKBACK_DAYS):
+    """Exponentially smoothed daily demand per product over the lookback window.
+
+    SQL sums each product's stock decreases per day; the smoothing runs on
+    that sparse table for all products at once (days without usage count as
+    zero demand). Returns ``{product_id: (daily_rate, reorder_point,
+    order_up_to)}`` for products that were used in the window.
+    """
+    today = datetime.now().date()
+    params = _history_params(user_id, today - timedelta(days=lookback_days - 1), today)
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT product_id, %(end)s::date - 1 - timestamp::date AS days_ago, SUM(units_out)
+            FROM ({movements}) m
+            WHERE units_out > 0
+            GROUP BY product_id, timestamp::date
+        """.format(movements=MOVEMENTS_SQL.format(end="%(end)s")), params)
+        rows = cur.fetchall()
+    
+    if not rows:
+        return {}
+    
+    usage = pd.DataFrame(rows, columns=['product_id', 'days_ago', 'units']).astype(float)
+    decay = 1 - REORDER_SMOOTHING
+    usage['weighted'] = usage['units'] * REORDER_SMOOTHING * decay ** usage['days_ago']
+    usage['squared'] = usage['units'] ** 2
+    totals = usage.groupby('product_id')[['weighted', 'units', 'squared']].sum()
+    
+    daily_rate = totals['weighted'] / (1 - decay ** lookback_days)
+    mean = totals['units'] / lookback_days
+    demand_std = np.sqrt((totals['squared'] / lookback_days - mean ** 2).clip(lower=0))
+    safety_stock = REORDER_SAFETY_FACTOR * demand_std * math.sqrt(REORDER_LEAD_TIME_DAYS)
+    reorder_point = np.ceil(daily_rate * REORDER_LEAD_TIME_DAYS + safety_stock)
+    order_up_to = np.ceil(daily_rate * (REORDER_LEAD_TIME_DAYS + REORDER_COVER_DAYS) + safety_stock)
+    
+    return {
+        int(product_id): (round(rate, 2), int(point), int(target))
+        for product_id, rate, point, target in zip(totals.index, daily_rate, reorder_point, order_up_to)
+    }
+
+def suggest_reorder(product_id, quantity, min_threshold, forecast):
+    """Return ``(suggested_quantity, reorder_point, daily_rate)`` for a product.
+
+    Orders enough to cover lead time plus REORDER_COVER_DAYS of forecast
+    demand, and always enough to clear the product's minimum threshold.
+    Products with no recent usage fall back to doubling the threshold.
+    """
+    if product_id not in forecast:
+        return max(1, min_threshold * 2 - quantity), min_threshold, 0.0
+    daily_rate, reorder_point, order_up_to = forecast[product_id]
+    target = max(order_up_to, min_threshold + 1)
+    return max(1, target - quantity), reorder_point, daily_rate
+
+# Bulk product import
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+IMPORT_COLUMNS = ("name", "supplier", "quantity", "min_threshold", "unit_price", "category", "description")
+# Largest values the INTEGER and DECIMAL(10,2) columns accept
+IMPORT_MAX_QUANTITY = 2**31 - 1
+IMPORT_MAX_PRICE = 99999999.99
+
+def read_import_rows(uploaded_file, filename):
+    """Yield ``(row_number, row_dict)`` from a CSV or XLSX upload, one row at a time"""
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        workbook = openpyxl.load_workbook(uploaded_file, read_only=True, data_only=True)
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(h or "").strip().lower() for h in next(rows, ())]
+        for row_number, values in enumerate(rows, start=2):
+            if any(v is not None and str(v).strip() for v in values):
+                yield row_number, dict(zip(header, values))
+        workbook.close()
+    else:
+        text = io.TextIOWrapper(uploaded_file, encoding="utf-8-sig", newline="")
+        try:
+            reader = csv.DictReader(text)
+            reader.fieldnames = [(h or "").strip().lower() for h in reader.fieldnames or []]
+            for row_number, row in enumerate(reader, start=2):
+                if any((v or "").strip() for v in row.values() if isinstance(v, str)):
+                    yield row_number, row
+        finally:
+            # Leave the caller's file open
+            text.detach()
+
+def _import_cell(row, column):
+    value = row.get(column)
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+def validate_import_row(row, supplier_ids):
+    """Turn an upload row into a staging tuple, raising ValueError on bad data"""
+    name = _import_cell(row, "name")
+    if not name:
+        raise ValueError("name is required")
+    
+    supplier_name = _import_cell(row, "supplier")
+    supplier_id = None
+    if supplier_name:
+        supplier_id = supplier_ids.get(supplier_name.lower())
+        if supplier_id is None:
+            raise ValueError(f"unknown supplier '{supplier_name}'")
+    
+    def number(column, default, whole=True, maximum=IMPORT_MAX_QUANTITY):
+        value = _import_cell(row, column)
+        if value is None:
+            return default
+        try:
+            parsed = float(value)
+        except ValueError:
+            raise ValueError(f"{column} must be a number, got '{value}'")
+        if not math.isfinite(parsed) or parsed < 0:
+            raise ValueError(f"{column} must be zero or more, got '{value}'")
+        if whole and not parsed.is_integer():
+            raise ValueError(f"{column} must be a whole number, got '{value}'")
+        parsed = int(parsed) if whole else round(parsed, 2)
+        if parsed > maximum:
+            raise ValueError(f"{column} must be at most {maximum:,}, got '{value}'")
+        return parsed
+    
+    quantity = number("quantity", 0)
+    min_threshold = number("min_threshold", 10)
+    unit_price = number("unit_price", None, whole=False, maximum=IMPORT_MAX_PRICE)
+    return (name, supplier_id, quantity, min_threshold, unit_price,
+            _import_cell(row, "category"), _import_cell(row, "description"))
+
+def import_products(rows, user_id, chunk_size=IMPORT_CHUNK_SIZE, on_progress=None):
+    """Stream validated rows into products through COPY and a staging table.
+
+    ``rows`` yields ``(row_number, row_dict)`` as produced by
+    ``read_import_rows``. Each chunk is COPY'd into a temporary staging
+    table and merged in bulk: products whose name already exists are
+    updated (logging an "IMPORT" change when the quantity moves), the rest
+    are inserted with an "ADD" log row. Chunks commit independently; a
+    chunk the database rejects is rolled back and its rows reported as
+    errors. ``on_progress(rows_seen, result)`` is called after every chunk.
+    Returns ``{"inserted", "updated", "errors"}``; errors are
+    ``(row_number, message)`` pairs for rows that were skipped.
+    """
+    supplier_ids = {}
+    for supplier in get_suppliers.uncached(user_id):
+        supplier_ids.setdefault(supplier[1].strip().lower(), supplier[0])
+    
+    result = {"inserted": 0, "updated": 0, "errors": []}
+    rows_seen = 0
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS product_import (
+                line INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                supplier_id INTEGER,
+                quantity INTEGER NOT NULL,
+                min_threshold INTEGER NOT NULL,
+                unit_price DECIMAL(10,2),
+                category TEXT,
+                description TEXT
+            ) ON COMMIT DELETE ROWS
+        """)
+        # Commit the table so rolling back a failed chunk doesn't drop it
         conn.commit()
-    finally:
-        conn.close()
+        
+        try:
+            chunk = []
+            for row_number, row in rows:
+                rows_seen += 1
+                try:
+                    chunk.append((row_number, *validate_import_row(row, supplier_ids)))
+                except ValueError as e:
+                    result["errors"].append((row_number, str(e)))
+                if len(chunk) >= chunk_size:
+                    _commit_import_chunk(conn, cur, chunk, user_id, result)
+                    chunk = []
+                    if on_progress:
+                        on_progress(rows_seen, result)
+            if chunk:
+                _commit_import_chunk(conn, cur, chunk, user_id, result)
+            cur.execute("DROP TABLE IF EXISTS product_import")
+            conn.commit()
+        finally:
+            # Earlier chunks may have committed even if a later step raised
+            invalidate_user_cache(user_id)
+    
+    if on_progress:
+        on_progress(rows_seen, result)
+    return result
 
-def init_whatsapp_templates(user_id):
-    """Initialize WhatsApp templates table for user"""
-    conn = get_connection()
+def _commit_import_chunk(conn, cur, chunk, user_id, result):
+    """Merge and commit one chunk, or roll it back and report its rows as errors"""
+    counts = {"inserted": 0, "updated": 0}
     try:
+        _merge_import_chunk(cur, chunk, user_id, counts)
+        conn.commit()
+        result["inserted"] += counts["inserted"]
+        result["updated"] += counts["updated"]
+    except psycopg2.Error as e:
+        conn.rollback()
+        message = f"rejected by the database: {e.diag.message_primary or str(e).strip()}"
+        result["errors"].extend((line[0], message) for line in chunk)
+
+def _merge_import_chunk(cur, chunk, user_id, result):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(chunk)
+    buffer.seek(0)
+    cur.copy_expert(
+        "COPY product_import (line, name, supplier_id, quantity, min_threshold, unit_price, category, description) "
+        "FROM STDIN WITH (FORMAT csv)",
+        buffer
+    )
+    
+    # The last row wins when a name repeats within the chunk
+    staged = """
+        staged AS (
+            SELECT DISTINCT ON (name) * FROM product_import ORDER BY name, line DESC
+        )
+    """
+    # Rows are locked in id order, like stock adjustments, so concurrent
+    # imports touching the same products can't deadlock
+    cur.execute(f"""
+        WITH {staged},
+        locked AS (
+            SELECT id, name, quantity FROM products
+            WHERE user_id = %(user_id)s AND name IN (SELECT name FROM staged)
+            ORDER BY id
+            FOR UPDATE
+        ), updated AS (
+            UPDATE products p
+            SET supplier_id = COALESCE(s.supplier_id, p.supplier_id),
+                quantity = s.quantity,
+                min_threshold = s.min_threshold,
+                unit_price = COALESCE(s.unit_price, p.unit_price),
+                category = COALESCE(s.category, p.category),
+                description = COALESCE(s.description, p.description),
+                updated_at = CURRENT_TIMESTAMP
+            FROM locked l JOIN staged s ON s.name = l.name
+            WHERE p.id = l.id
+            RETURNING p.id, l.quantity AS previous_quantity, p.quantity AS new_quantity
+        ), logged AS (
+            INSERT INTO inventory_logs (user_id, product_id, action, quantity_change, previous_quantity, new_quantity)
+            SELECT %(user_id)s, id, 'IMPORT', new_quantity - previous_quantity, previous_quantity, new_quantity
+            FROM updated WHERE new_quantity <> previous_quantity
+        )
+        SELECT COUNT(*) FROM updated
+    """, {"user_id": user_id})
+    result["updated"] += cur.fetchone()[0]
+    
+    cur.execute(f"""
+        WITH {staged},
+        inserted AS (
+            INSERT INTO products (user_id, name, supplier_id, quantity, min_threshold, unit_price, category, description)
+            SELECT %(user_id)s, s.name, s.supplier_id, s.quantity, s.min_threshold, s.unit_price, s.category, s.description
+            FROM staged s
+            WHERE NOT EXISTS (SELECT 1 FROM products p WHERE p.user_id = %(user_id)s AND p.name = s.name)
+            RETURNING id, quantity
+        ), logged AS (
+            INSERT INTO inventory_logs (user_id, product_id, action, quantity_change, previous_quantity, new_quantity)
+            SELECT %(user_id)s, id, 'ADD', quantity, 0, quantity FROM inserted
+        )
+        SELECT COUNT(*) FROM inserted
+    """, {"user_id": user_id})
+    result["inserted"] += cur.fetchone()[0]
+
+# Streaming exports
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "10000"))
+EXPORT_KINDS = ("products", "inventory_logs")
+# Largest file the web UI builds for download; bigger exports go through export_data.py
+EXPORT_UI_MAX_BYTES = int(float(os.getenv("EXPORT_UI_MAX_MB", "50")) * 1024 * 1024)
+
+class CappedWriter:
+    """File wrapper that raises ValueError once more than ``limit`` bytes are written"""
+
+    def __init__(self, out, limit):
+        self.out = out
+        self.limit = limit
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        if self.written > self.limit:
+            raise ValueError(f"This export is larger than {self.limit // (1024 * 1024)} MB; "
+                             "narrow the filters or run `python export_data.py` on the server")
+        return self.out.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.out, name)
+
+def _export_query(kind, user_id, start=None, end=None, product_id=None, product_search=None):
+    params = {"user_id": user_id, "start": start, "end": end,
+              "product_id": product_id, "product_search": f"%{product_search}%" if product_search else None}
+    if kind == "products":
+        return """
+            SELECT p.id, p.name, s.name AS supplier, p.quantity, p.min_threshold, p.unit_price,
+                   p.category, p.description, p.created_at, p.updated_at
+            FROM products p
+            LEFT JOIN suppliers s ON p.supplier_id = s.id
+            WHERE p.user_id = %(user_id)s
+            ORDER BY p.id
+        """, params
+    if kind == "inventory_logs":
+        conditions = ["l.user_id = %(user_id)s"]
+        if start:
+            conditions.append("l.timestamp >= %(start)s")
+        if end:
+            conditions.append("l.timestamp < %(end)s")
+        if product_id:
+            conditions.append("l.product_id = %(product_id)s")
+        if product_search:
+            conditions.append("p.name ILIKE %(product_search)s")
+        return f"""
+            SELECT l.id, l.product_id, p.name AS product_name, l.action, l.quantity_change,
+                   l.previous_quantity, l.new_quantity, l.timestamp
+            FROM inventory_logs l
+            LEFT JOIN products p ON l.product_id = p.id
+            WHERE {" AND ".join(conditions)}
+            ORDER BY l.timestamp, l.id
+        """, params
+    raise ValueError(f"Unknown export '{kind}'; expected one of {', '.join(EXPORT_KINDS)}")
+
+def _export_schema(kind):
+    import pyarrow as pa
+    if kind == "products":
+        return pa.schema([
+            ("id", pa.int64()), ("name", pa.string()), ("supplier", pa.string()),
+            ("quantity", pa.int64()), ("min_threshold", pa.int64()), ("unit_price", pa.decimal128(10, 2)),
+            ("category", pa.string()), ("description", pa.string()),
+            ("created_at", pa.timestamp("us")), ("updated_at", pa.timestamp("us")),
+        ])
+    return pa.schema([
+        ("id", pa.int64()), ("product_id", pa.int64()), ("product_name", pa.string()), ("action", pa.string()),
+        ("quantity_change", pa.int64()), ("previous_quantity", pa.int64()), ("new_quantity", pa.int64()),
+        ("timestamp", pa.timestamp("us")),
+    ])
+
+def export_csv(kind, out, user_id, **filters):
+    """Stream ``products`` or ``inventory_logs`` as CSV into ``out`` via COPY TO STDOUT.
+
+    ``filters`` (logs only) are ``start``/``end`` datetimes and
+    ``product_id`` or ``product_search``. Rows flow straight from the
+    server to ``out`` without being held in Python.
+    """
+    query, params = _export_query(kind, user_id, **filters)
+    with get_connection() as conn:
         cur = conn.cursor()
+        statement = cur.mogrify(query, params).decode()
+        cur.copy_expert(f"COPY ({statement}) TO STDOUT WITH (FORMAT csv, HEADER)", out)
+
+def export_parquet(kind, out, user_id, **filters):
+    """Stream an export as Parquet, one row group per server-side cursor batch"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet export needs the pyarrow package; export as CSV instead")
+    
+    query, params = _export_query(kind, user_id, **filters)
+    schema = _export_schema(kind)
+    rows_written = 0
+    with get_connection() as conn, pq.ParquetWriter(out, schema) as writer:
+        with conn.cursor(name=f"export_{kind}") as cur:
+            cur.itersize = EXPORT_BATCH_SIZE
+            cur.execute(query, params)
+            while True:
+                rows = cur.fetchmany(EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+                columns = list(zip(*rows))
+                writer.write_batch(pa.RecordBatch.from_arrays(
+                    [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                    schema=schema
+                ))
+                rows_written += len(rows)
+    return rows_written
+
+def init_whatsapp_templates(user_id):
+    """Initialize WhatsApp templates table for user"""
+    with get_connection() as conn:
+        try:
+            cur = conn.cursor()
         
-        # Create default templates if none exist
-        cur.execute(f"SELECT COUNT(*) FROM whatsapp_templates_{user_id}")
-        if cur.fetchone()[0] == 0:
-            default_templates = [
-                ("Professional Reorder", """Hello {supplier_name},
+            # Create default templates if none exist
+            cur.execute("SELECT COUNT(*) FROM whatsapp_templates WHERE user_id = %s", (user_id,))
+            if cur.fetchone()[0] == 0:
+                default_templates = [
+                    ("Professional Reorder", """Hello {supplier_name},
 
 I hope this message finds you well. We need to reorder the following items:
 
@@ -303,7 +2523,7 @@ Please confirm availability and provide updated pricing in Rupees (₹).
 
 Best regards,
 {company_name}""", True),
-                ("Urgent Reorder", """🚨 URGENT REORDER REQUEST 🚨
+                    ("Urgent Reorder", """🚨 URGENT REORDER REQUEST 🚨
 
 Hi {supplier_name},
 
@@ -315,7 +2535,7 @@ Please prioritize this order and confirm delivery timeline with pricing in ₹.
 
 Thanks,
 {company_name}""", False),
-                ("Friendly Reorder", """Hi {supplier_name}! 👋
+                    ("Friendly Reorder", """Hi {supplier_name}! 👋
 
 Hope you're doing great! We need to stock up on:
 
@@ -324,73 +2544,64 @@ Hope you're doing great! We need to stock up on:
 Let me know when you can deliver these with pricing in ₹. Thanks!
 
 {company_name}""", False)
-            ]
+                ]
             
-            for template in default_templates:
-                cur.execute(
-                    f"INSERT INTO whatsapp_templates_{user_id} (name, template_text, is_default) VALUES (%s, %s, %s)",
-                    template
-                )
+                for template in default_templates:
+                    cur.execute(
+                        "INSERT INTO whatsapp_templates (user_id, name, template_text, is_default) VALUES (%s, %s, %s, %s)",
+                        (user_id, *template)
+                    )
         
-        conn.commit()
-    except Exception as e:
-        st.error(f"WhatsApp templates initialization error: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
+            conn.commit()
+            invalidate_user_cache(user_id)
+        except Exception as e:
+            st.error(f"WhatsApp templates initialization error: {e}")
+            conn.rollback()
 
+@cached_query("templates")
 def get_whatsapp_templates(user_id):
     """Get all WhatsApp templates for a user"""
-    conn = get_connection()
-    try:
+    with get_connection() as conn:
         cur = conn.cursor()
-        cur.execute(f"SELECT id, name, template_text, is_default FROM whatsapp_templates_{user_id} ORDER BY is_default DESC, name")
+        cur.execute("SELECT id, name, template_text, is_default, updated_at FROM whatsapp_templates WHERE user_id = %s ORDER BY is_default DESC, name", (user_id,))
         return cur.fetchall()
-    finally:
-        conn.close()
 
 def add_whatsapp_template(name, template_text, user_id):
-    """Add a new WhatsApp template"""
-    conn = get_connection()
-    try:
+    """Add a new WhatsApp template; raises ValueError for unknown placeholders"""
+    validate_template(template_text)
+    with get_connection() as conn:
         cur = conn.cursor()
         cur.execute(
-            f"INSERT INTO whatsapp_templates_{user_id} (name, template_text) VALUES (%s, %s) RETURNING id",
-            (name, template_text)
+            "INSERT INTO whatsapp_templates (user_id, name, template_text) VALUES (%s, %s, %s) RETURNING id",
+            (user_id, name, template_text)
         )
         template_id = cur.fetchone()[0]
         conn.commit()
+        invalidate_user_cache(user_id)
         return template_id
-    finally:
-        conn.close()
 
 def delete_whatsapp_template(template_id, user_id):
     """Delete a WhatsApp template"""
-    conn = get_connection()
-    try:
+    with get_connection() as conn:
         cur = conn.cursor()
-        cur.execute(f"DELETE FROM whatsapp_templates_{user_id} WHERE id = %s AND is_default = FALSE", (template_id,))
+        cur.execute("DELETE FROM whatsapp_templates WHERE id = %s AND user_id = %s AND is_default = FALSE", (template_id, user_id))
         conn.commit()
-    finally:
-        conn.close()
+        invalidate_user_cache(user_id)
 
 def update_whatsapp_template(template_id, name, template_text, user_id):
-    """Update a WhatsApp template"""
-    conn = get_connection()
-    try:
+    """Update a WhatsApp template; raises ValueError for unknown placeholders"""
+    validate_template(template_text)
+    with get_connection() as conn:
         cur = conn.cursor()
         cur.execute(
-            f"UPDATE whatsapp_templates_{user_id} SET name = %s, template_text = %s WHERE id = %s AND is_default = FALSE",
-            (name, template_text, template_id)
+            "UPDATE whatsapp_templates SET name = %s, template_text = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s AND user_id = %s AND is_default = FALSE",
+            (name, template_text, template_id, user_id)
         )
         conn.commit()
-    finally:
-        conn.close()
+        invalidate_user_cache(user_id)
 
-def generate_whatsapp_message(supplier_name, contact_number, items_with_quantities, template_text=None, company_name="Inventory Management Team"):
-    """Generate WhatsApp message with custom template and quantities"""
-    if not template_text:
-        template_text = """Hello {supplier_name},
+# Reorder message rendering
+DEFAULT_TEMPLATE_TEXT = """Hello {supplier_name},
 
 We need to reorder the following items:
 
@@ -400,20 +2611,248 @@ Please let us know the availability and pricing.
 
 Thanks,
 {company_name}"""
-    
-    # Format items list
-    items_list = ""
+
+TEMPLATE_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+# Placeholders a template may use, with the help text shown to users
+TEMPLATE_FIELDS = {
+    "supplier_name": "Supplier's name",
+    "items_list": "List of items to order",
+    "items_with_prices": "Items with unit price and line total",
+    "item_count": "Number of items ordered",
+    "order_total": "Total order value in ₹",
+    "company_name": "Your company name",
+    "date": "Today's date",
+}
+
+# Sample order used for template previews
+PREVIEW_ITEMS = [
+    {'name': "Product A", 'quantity': 50, 'current_stock': 5, 'unit_price': 12.5},
+    {'name': "Product B", 'quantity': 30, 'current_stock': 2, 'unit_price': 40},
+]
+
+def compile_template(template_text):
+    """Split a template once into alternating literal text and placeholder names"""
+    return tuple(TEMPLATE_PLACEHOLDER.split(template_text))
+
+@st.cache_resource(show_spinner=False, max_entries=1024)
+def compile_saved_template(template_id, updated_at, _template_text):
+    """Compiled form of a stored template, cached per (id, updated_at)"""
+    return compile_template(_template_text)
+
+def get_compiled_template(template):
+    """Compile a row from get_whatsapp_templates, reusing the cached result"""
+    return compile_saved_template(template[0], template[4], template[2])
+
+def validate_template(template_text):
+    """Raise ValueError if the template uses placeholders outside TEMPLATE_FIELDS"""
+    unknown = sorted(set(compile_template(template_text)[1::2]) - TEMPLATE_FIELDS.keys())
+    if unknown:
+        raise ValueError(
+            f"Unknown placeholder(s) {', '.join('{' + name + '}' for name in unknown)}. "
+            f"Available: {', '.join('{' + name + '}' for name in TEMPLATE_FIELDS)}"
+        )
+
+def render_template(compiled, fields):
+    """Fill a compiled template in a single pass; unknown placeholders are left as written"""
+    return "".join(
+        part if i % 2 == 0 else fields.get(part, "{" + part + "}")
+        for i, part in enumerate(compiled)
+    )
+
+def format_price(value):
+    return f"₹{value:,.2f}"
+
+def format_items_list(items_with_quantities):
+    return "\n".join(
+        f"• {item['name']}: {item['quantity']} units (Current stock: {item['current_stock']})"
+        for item in items_with_quantities
+    )
+
+def format_items_with_prices(items_with_quantities):
+    lines = []
     for item in items_with_quantities:
-        items_list += f"• {item['name']}: {item['quantity']} units (Current stock: {item['current_stock']})\n"
-    
-    # Replace placeholders
-    message = template_text.replace("{supplier_name}", supplier_name)
-    message = message.replace("{items_list}", items_list.strip())
-    message = message.replace("{company_name}", company_name)
-    
-    encoded_message = urllib.parse.quote(message)
-    whatsapp_url = f"https://wa.me/{contact_number.replace('+', '')}?text={encoded_message}"
-    return whatsapp_url
+        price = item.get('unit_price')
+        if price is None:
+            lines.append(f"• {item['name']}: {item['quantity']} units")
+        else:
+            lines.append(f"• {item['name']}: {item['quantity']} × {format_price(price)} = {format_price(item['quantity'] * float(price))}")
+    return "\n".join(lines)
+
+def order_total(items_with_quantities):
+    return sum(item['quantity'] * float(item['unit_price'])
+               for item in items_with_quantities if item.get('unit_price') is not None)
+
+def whatsapp_url(contact_number, message):
+    return f"https://wa.me/{contact_number.replace('+', '')}?text={urllib.parse.quote(message)}"
+
+def render_reorder_message(compiled, supplier_name, items_with_quantities, company_name):
+    """Render a reorder message, building only the fields the template uses"""
+    used = set(compiled[1::2])
+    fields = {
+        "supplier_name": supplier_name,
+        "company_name": company_name,
+        "item_count": str(len(items_with_quantities)),
+    }
+    if "items_list" in used:
+        fields["items_list"] = format_items_list(items_with_quantities)
+    if "items_with_prices" in used:
+        fields["items_with_prices"] = format_items_with_prices(items_with_quantities)
+    if "order_total" in used:
+        fields["order_total"] = format_price(order_total(items_with_quantities))
+    if "date" in used:
+        fields["date"] = datetime.now().strftime("%d %b %Y")
+    return render_template(compiled, fields)
+
+def generate_whatsapp_message(supplier_name, contact_number, items_with_quantities, template_text=None, company_name="Inventory Management Team"):
+    """Generate WhatsApp message with custom template and quantities"""
+    compiled = compile_template(template_text or DEFAULT_TEMPLATE_TEXT)
+    message = render_reorder_message(compiled, supplier_name, items_with_quantities, company_name)
+    return whatsapp_url(contact_number, message)
+
+def compose_reorder_messages(low_stock_groups, compiled, company_name, forecast):
+    """Render one reorder message per supplier with low stock, in one pass.
+
+    ``compiled`` comes from compile_template/get_compiled_template and each
+    item is ordered at its suggest_reorder quantity. Products without a
+    supplier are skipped. Returns dicts with supplier, phone, items, message
+    and url.
+    """
+    messages = []
+    for supplier_id, supplier_name, contact, _, items in low_stock_groups:
+        if supplier_id is None:
+            continue
+        order = [
+            {'name': name, 'quantity': suggest_reorder(product_id, quantity + on_order, min_threshold, forecast)[0],
+             'current_stock': quantity, 'unit_price': unit_price}
+            for product_id, name, quantity, min_threshold, unit_price, on_order in items
+        ]
+        message = render_reorder_message(compiled, supplier_name, order, company_name)
+        messages.append({
+            'supplier': supplier_name,
+            'phone': contact,
+            'items': len(order),
+            'message': message,
+            'url': whatsapp_url(contact, message),
+        })
+    return messages
+
+# Outbound message queue, drained by outbox_worker.py
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_RETRY_SECONDS = int(os.getenv("OUTBOX_RETRY_SECONDS", "30"))
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "300"))
+
+def enqueue_messages(messages, user_id):
+    """Queue rendered messages (dicts with supplier, phone, message) for delivery.
+
+    A message already queued today for the same phone with the same text is
+    skipped, so a double click can't send a supplier the order twice.
+    Returns how many were queued.
+    """
+    if not messages:
+        return 0
+    today = f"{datetime.now():%Y-%m-%d}"
+    with get_connection() as conn:
+        cur = conn.cursor()
+        queued = execute_values(
+            cur,
+            """
+            INSERT INTO message_outbox (user_id, supplier_name, phone, message, dedupe_key) VALUES %s
+            ON CONFLICT (user_id, dedupe_key) WHERE status <> 'failed' DO NOTHING
+            RETURNING id
+            """,
+            [(user_id, m['supplier'], m['phone'], m['message'],
+              f"{today}:{m['phone']}:{hashlib.sha256(m['message'].encode('utf-8')).hexdigest()}")
+             for m in messages],
+            page_size=1000,
+            fetch=True
+        )
+        conn.commit()
+        return len(queued)
+
+def claim_outbox_messages(limit):
+    """Mark up to ``limit`` due messages as sending and return them.
+
+    SKIP LOCKED lets several workers claim disjoint batches. Rows left in
+    'sending' longer than OUTBOX_LEASE_SECONDS (a crashed worker) are due
+    again, unless they have used up OUTBOX_MAX_ATTEMPTS, in which case they
+    are marked failed. Returns ``(id, phone, message, attempts, claimed_at)``
+    tuples; ``claimed_at`` identifies this claim when completing it.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        # A message that keeps crashing or hanging its worker must not be retried forever
+        cur.execute("""
+            UPDATE message_outbox
+            SET status = 'failed', last_error = 'delivery did not finish within the lease'
+            WHERE status = 'sending' AND attempts >= %(max_attempts)s
+              AND claimed_at < LOCALTIMESTAMP - make_interval(secs => %(lease)s)
+        """, {"max_attempts": OUTBOX_MAX_ATTEMPTS, "lease": OUTBOX_LEASE_SECONDS})
+        cur.execute("""
+            UPDATE message_outbox o
+            SET status = 'sending', attempts = o.attempts + 1, claimed_at = LOCALTIMESTAMP
+            FROM (
+                SELECT id FROM message_outbox
+                WHERE (status = 'pending' AND available_at <= LOCALTIMESTAMP)
+                   OR (status = 'sending' AND claimed_at < LOCALTIMESTAMP - make_interval(secs => %(lease)s))
+                ORDER BY available_at, id
+                LIMIT %(limit)s
+                FOR UPDATE SKIP LOCKED
+            ) due
+            WHERE o.id = due.id
+            RETURNING o.id, o.phone, o.message, o.attempts, o.claimed_at
+        """, {"limit": limit, "lease": OUTBOX_LEASE_SECONDS})
+        claimed = cur.fetchall()
+        conn.commit()
+        return claimed
+
+def complete_outbox_messages(results):
+    """Record a batch of delivery results in one statement.
+
+    ``results`` holds ``(id, claimed_at, attempts, error, retryable)``;
+    ``error`` is None on success. Retryable failures go back to pending with
+    exponential backoff until OUTBOX_MAX_ATTEMPTS, then the message is marked
+    failed. Rows whose lease was taken over by another worker are left alone.
+    """
+    if not results:
+        return
+    rows = []
+    for message_id, claimed_at, attempts, error, retryable in results:
+        if error is None:
+            status = 'sent'
+        elif retryable and attempts < OUTBOX_MAX_ATTEMPTS:
+            status = 'pending'
+        else:
+            status = 'failed'
+        rows.append((message_id, claimed_at, status, error, OUTBOX_RETRY_SECONDS * 2 ** (attempts - 1)))
+    with get_connection() as conn:
+        cur = conn.cursor()
+        execute_values(cur, """
+            UPDATE message_outbox o
+            SET status = v.status,
+                last_error = v.error,
+                sent_at = CASE WHEN v.status = 'sent' THEN LOCALTIMESTAMP END,
+                available_at = CASE WHEN v.status = 'pending'
+                                    THEN LOCALTIMESTAMP + make_interval(secs => v.delay)
+                                    ELSE o.available_at END
+            FROM (VALUES %s) AS v(id, claimed_at, status, error, delay)
+            WHERE o.id = v.id AND o.status = 'sending' AND o.claimed_at = v.claimed_at
+        """, rows, template="(%s::bigint, %s::timestamp, %s, %s, %s::integer)")
+        conn.commit()
+
+def get_outbox_status(user_id):
+    """Message counts per status for a user's outbox"""
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT status, COUNT(*) FROM message_outbox WHERE user_id = %s GROUP BY status", (user_id,))
+        return dict(cur.fetchall())
+
+def reorder_messages_csv(messages):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=['supplier', 'phone', 'items', 'message', 'url'])
+    writer.writeheader()
+    writer.writerows(messages)
+    return out.getvalue()
 
 def load_custom_css():
     st.markdown("""
@@ -973,18 +3412,18 @@ def show_login_page():
                 
                 if login_btn:
                     if phone and password:
-                        user = login_user(phone, password)
-                        if user:
-                            st.session_state.user = user
-                            # Initialize user database if it doesn't exist
-                            try:
-                                get_suppliers(user['id'])
-                            except:
-                                init_user_database(user['id'])
-                            st.success("✅ Welcome back!")
-                            st.rerun()
+                        try:
+                            user = login_user(phone, password)
+                        except ValueError as e:
+                            st.error(f"⏳ {e}")
                         else:
-                            st.error("❌ Invalid credentials!")
+                            if user:
+                                st.session_state.user = user
+                                st.query_params["session"] = create_session(user)
+                                st.success("✅ Welcome back!")
+                                st.rerun()
+                            else:
+                                st.error("❌ Invalid credentials!")
                     else:
                         st.error("⚠️ Please fill all fields!")
         
@@ -997,11 +3436,15 @@ def show_login_page():
                 
                 if register_btn:
                     if name and phone and password:
-                        user_id = register_user(name, phone, password)
-                        if user_id:
-                            st.success("🎉 Account created! You get your own private database. Please sign in.")
+                        try:
+                            user_id = register_user(name, phone, password)
+                        except ValueError as e:
+                            st.error(f"⏳ {e}")
                         else:
-                            st.error("❌ Phone number already exists!")
+                            if user_id:
+                                st.success("🎉 Account created! You get your own private database. Please sign in.")
+                            else:
+                                st.error("❌ Phone number already exists!")
                     else:
                         st.error("⚠️ Please fill all fields!")
 
@@ -1015,20 +3458,22 @@ def show_navigation():
     
     st.markdown('<div class="nav-container">', unsafe_allow_html=True)
     
-    col1, col2, col3, col4, col5 = st.columns(5)
-    
     navigation_items = [
         ("📊", "Dashboard", "Analytics & Overview", "dashboard"),
+        ("📦", "Products", "Browse Inventory", "products"),
         ("➕", "Add Product", "Add New Items", "add_product"),
         ("🏢", "Suppliers", "Manage Suppliers", "suppliers"),
+        ("📈", "History", "Stock Movements", "history"),
         ("⚠️", "Alerts", "Stock Warnings", "alerts"),
+        ("🧾", "Orders", "Purchase Orders", "purchase_orders"),
         ("📱", "WhatsApp", "Message Templates", "whatsapp_templates")
     ]
+    columns = st.columns(len(navigation_items))
     
     selected_page = None
     
     for i, (icon, title, desc, key) in enumerate(navigation_items):
-        with [col1, col2, col3, col4, col5][i]:
+        with columns[i]:
             if st.button(f"{title}", key=f"nav_{key}", use_container_width=True, help=f"Go to {title}"):
                 selected_page = key
     
@@ -1041,11 +3486,18 @@ def main():
         page_title="InventoryPro", 
         page_icon="🏢", 
         layout="wide",
-        initial_sidebar_state="collapsed"
+        initial_sidebar_state="expanded" if st.session_state.get("profiler") else "collapsed"
     )
     
-    # Initialize main database
-    init_main_database()
+    if METRICS_PORT:
+        start_metrics_server(METRICS_HOST, METRICS_PORT)
+    
+    # Initialize main database (cached, so this only hits the DB once per process)
+    try:
+        init_main_database()
+    except Exception as e:
+        st.error(f"Main database initialization error: {e}")
+        st.stop()
     
     # Session state initialization
     if 'user' not in st.session_state:
@@ -1053,46 +3505,70 @@ def main():
     if 'current_page' not in st.session_state:
         st.session_state.current_page = "dashboard"
     
+    # Re-check the session token every rerun (an HMAC and an LRU lookup), which
+    # also restores the sign-in after a refresh or websocket reconnect
+    token = st.query_params.get("session")
+    if token:
+        st.session_state.user = validate_session_token(token)
+        if st.session_state.user is None:
+            del st.query_params["session"]
+    
     # Authentication
     if st.session_state.user is None:
         show_login_page()
     else:
-        load_custom_css()
+        with profile_section("render: styles"):
+            load_custom_css()
         
         # Header with logout
         col1, col2 = st.columns([4, 1])
         with col2:
             if st.button("🚪 Logout", type="secondary"):
+                if token:
+                    revoke_session(token)
+                    del st.query_params["session"]
                 st.session_state.user = None
                 st.session_state.current_page = "dashboard"
                 st.rerun()
         
         # Navigation
-        selected_page = show_navigation()
+        with profile_section("render: navigation"):
+            selected_page = show_navigation()
         if selected_page:
             st.session_state.current_page = selected_page
             st.rerun()
         
-        # Ensure user database is properly initialized
+        # Ensure user database is properly initialized (once per process)
         user_id = st.session_state.user['id']
         try:
-            # Test if WhatsApp templates table exists
-            get_whatsapp_templates(user_id)
-        except:
-            # If not, initialize it
-            init_whatsapp_templates(user_id)
+            ensure_user_database(user_id)
+        except Exception as e:
+            st.error(f"User database initialization error: {e}")
+            st.stop()
+        
+        # Hidden instrumentation page for admins, opened with ?page=metrics
+        if st.query_params.get("page") == "metrics" and st.session_state.user.get('phone') in METRICS_ADMIN_PHONES:
+            show_db_metrics()
+            return
         
-        # Show current page
-        if st.session_state.current_page == "dashboard":
-            show_dashboard()
-        elif st.session_state.current_page == "add_product":
-            show_add_product()
-        elif st.session_state.current_page == "suppliers":
-            show_manage_suppliers()
-        elif st.session_state.current_page == "alerts":
-            show_low_stock_alerts()
-        elif st.session_state.current_page == "whatsapp_templates":
-            show_whatsapp_templates()
+        # Show current page, timed as one section when profiling
+        with profile_section(f"render: {st.session_state.current_page}"):
+            if st.session_state.current_page == "dashboard":
+                show_dashboard()
+            elif st.session_state.current_page == "products":
+                show_product_browser()
+            elif st.session_state.current_page == "add_product":
+                show_add_product()
+            elif st.session_state.current_page == "suppliers":
+                show_manage_suppliers()
+            elif st.session_state.current_page == "history":
+                show_inventory_history()
+            elif st.session_state.current_page == "alerts":
+                show_low_stock_alerts()
+            elif st.session_state.current_page == "purchase_orders":
+                show_purchase_orders()
+            elif st.session_state.current_page == "whatsapp_templates":
+                show_whatsapp_templates()
 
 def show_dashboard():
     st.markdown("""
@@ -1105,9 +3581,8 @@ def show_dashboard():
     user_id = st.session_state.user['id']
     
     # Get data
-    products = get_products(user_id)
-    low_stock = get_low_stock_products(user_id)
-    suppliers = get_suppliers(user_id)
+    with profile_section("fetch: dashboard data"):
+        summary, products = load_dashboard_data(user_id)
     
     # Metrics row
     st.markdown('<div class="metrics-grid">', unsafe_allow_html=True)
@@ -1116,16 +3591,15 @@ def show_dashboard():
     with col1:
         st.markdown(f"""
         <div class="metric-card">
-            <div class="metric-value">{len(products)}</div>
+            <div class="metric-value">{summary['product_count']}</div>
             <div class="metric-label">📦 Total Products</div>
         </div>
         """, unsafe_allow_html=True)
     
     with col2:
-        total_value = sum([float(p[5]) * p[3] for p in products if p[5]]) if products else 0
         st.markdown(f"""
         <div class="metric-card">
-            <div class="metric-value">₹{total_value:,.0f}</div>
+            <div class="metric-value">₹{summary['inventory_value']:,.0f}</div>
             <div class="metric-label">💰 Inventory Value</div>
         </div>
         """, unsafe_allow_html=True)
@@ -1133,7 +3607,7 @@ def show_dashboard():
     with col3:
         st.markdown(f"""
         <div class="metric-card">
-            <div class="metric-value">{len(low_stock)}</div>
+            <div class="metric-value">{summary['low_stock_count']}</div>
             <div class="metric-label">⚠️ Low Stock Items</div>
         </div>
         """, unsafe_allow_html=True)
@@ -1141,7 +3615,7 @@ def show_dashboard():
     with col4:
         st.markdown(f"""
         <div class="metric-card">
-            <div class="metric-value">{len(suppliers)}</div>
+            <div class="metric-value">{summary['supplier_count']}</div>
             <div class="metric-label">🏢 Active Suppliers</div>
         </div>
         """, unsafe_allow_html=True)
@@ -1153,32 +3627,35 @@ def show_dashboard():
         
         with col1:
             # Stock levels chart
-            df = pd.DataFrame(products, columns=['id', 'name', 'supplier', 'quantity', 'min_threshold', 'unit_price', 'category', 'description', 'supplier_contact'])
-            fig = px.bar(df.head(8), x='name', y='quantity', title="📊 Stock Levels by Product",
-                        color='quantity', color_continuous_scale='Blues')
-            fig.update_layout(
-                plot_bgcolor='white',
-                paper_bgcolor='white',
-                font_family="Inter",
-                title_font_size=18,
-                xaxis_tickangle=-45,
-                showlegend=False
-            )
-            st.plotly_chart(fig, use_container_width=True)
-        
-        with col2:
-            # Category distribution
-            if df['category'].notna().any():
-                category_counts = df['category'].value_counts()
-                fig = px.pie(values=category_counts.values, names=category_counts.index, 
-                           title="📈 Products by Category")
+            with profile_section("dataframe: stock levels"):
+                df = pd.DataFrame(products, columns=['id', 'name', 'supplier', 'quantity', 'min_threshold', 'unit_price', 'category'])
+            with profile_section("chart: stock levels"):
+                fig = px.bar(df, x='name', y='quantity', title="📊 Stock Levels by Product",
+                            color='quantity', color_continuous_scale='Blues')
                 fig.update_layout(
                     plot_bgcolor='white',
                     paper_bgcolor='white',
                     font_family="Inter",
                     title_font_size=18,
-                    showlegend=True
+                    xaxis_tickangle=-45,
+                    showlegend=False
                 )
+            st.plotly_chart(fig, use_container_width=True)
+        
+        with col2:
+            # Category distribution
+            if summary['categories']:
+                with profile_section("chart: categories"):
+                    names, counts, _ = zip(*summary['categories'])
+                    fig = px.pie(values=counts, names=names, 
+                               title="📈 Products by Category")
+                    fig.update_layout(
+                        plot_bgcolor='white',
+                        paper_bgcolor='white',
+                        font_family="Inter",
+                        title_font_size=18,
+                        showlegend=True
+                    )
                 st.plotly_chart(fig, use_container_width=True)
     
     # Quick inventory management
@@ -1189,7 +3666,9 @@ def show_dashboard():
     </div>
     """, unsafe_allow_html=True)
     
-    if products:
+    if products and st.toggle("📝 Bulk edit mode", key="bulk_edit_mode", help="Edit many quantities and save them together"):
+        show_bulk_quantity_editor(user_id)
+    elif products:
         st.markdown('<div class="product-grid">', unsafe_allow_html=True)
         
         for product in products[:6]:  # Show first 6 products
@@ -1223,6 +3702,176 @@ def show_dashboard():
     else:
         st.info("📦 No products yet. Add your first product to get started!")
 
+def show_bulk_quantity_editor(user_id):
+    """Editable stock grid whose changes are saved in a single batch"""
+    with profile_section("fetch: suppliers"):
+        suppliers = get_suppliers(user_id)
+    supplier_options = {"All suppliers": None}
+    supplier_options.update({f"{s[1]} ({s[2]})": s[0] for s in suppliers})
+    supplier_key = st.selectbox("🏢 Supplier", options=list(supplier_options.keys()), key="bulk_edit_supplier")
+    
+    with profile_section("fetch: bulk edit products"):
+        products, more = get_products_page(user_id, limit=BULK_EDIT_LIMIT, supplier_id=supplier_options[supplier_key])
+    if more:
+        st.caption(f"Showing the first {BULK_EDIT_LIMIT} products; pick a supplier to narrow the list.")
+    
+    with profile_section("dataframe: bulk edit grid"):
+        df = pd.DataFrame(
+            [(p[0], p[1], p[2] or 'N/A', p[3], p[4]) for p in products],
+            columns=['id', 'name', 'supplier', 'quantity', 'min_threshold']
+        )
+    
+    with st.form("bulk_quantity_form"):
+        edited = st.data_editor(
+            df,
+            key="bulk_quantity_editor",
+            hide_index=True,
+            use_container_width=True,
+            disabled=['id', 'name', 'supplier', 'min_threshold'],
+            column_config={
+                'id': None,
+                'name': "📦 Product",
+                'supplier': "🏢 Supplier",
+                'quantity': st.column_config.NumberColumn("📊 Quantity", min_value=0, step=1, required=True),
+                'min_threshold': "⚠️ Minimum"
+            }
+        )
+        submitted = st.form_submit_button("💾 Save All Changes", use_container_width=True)
+    
+    if submitted:
+        changed = edited[edited['quantity'] != df['quantity']]
+        # Save the edits as deltas so sales made since the grid loaded aren't overwritten
+        adjustments = [
+            (int(row.id), f"{int(row.quantity) - int(old_qty):+d}", "INCREASE" if row.quantity > old_qty else "DECREASE")
+            for row, old_qty in zip(changed.itertuples(), df.loc[changed.index, 'quantity'])
+        ]
+        if adjustments:
+            applied = apply_stock_adjustments(adjustments, user_id)
+            st.success(f"Updated {len(applied)} products")
+            st.rerun()
+        else:
+            st.info("No quantity changes to save")
+
+def show_product_browser():
+    st.markdown("""
+    <div class="page-header">
+        <h2 class="page-title">📦 Product Browser</h2>
+        <p class="page-subtitle">Browse and filter your full catalog page by page</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    user_id = st.session_state.user['id']
+    with profile_section("fetch: filters"):
+        suppliers = get_suppliers(user_id)
+        categories = get_product_categories(user_id)
+    
+    col1, col2, col3 = st.columns([2, 2, 1])
+    with col1:
+        category = st.selectbox("🏷️ Category", options=["All"] + categories)
+    with col2:
+        supplier_options = {"All": None}
+        supplier_options.update({f"{s[1]} ({s[2]})": s[0] for s in suppliers})
+        supplier_key = st.selectbox("🏢 Supplier", options=list(supplier_options.keys()))
+    with col3:
+        low_stock_only = st.checkbox("⚠️ Low stock only")
+    
+    filters = {
+        'category': None if category == "All" else category,
+        'supplier_id': supplier_options[supplier_key],
+        'low_stock_only': low_stock_only,
+    }
+    
+    # Cursor stack for keyset paging; reset whenever the filters change
+    if st.session_state.get('product_browser_filters') != filters:
+        st.session_state.product_browser_filters = filters
+        st.session_state.product_browser_cursors = [None]
+    cursors = st.session_state.product_browser_cursors
+    
+    with profile_section("fetch: products page"):
+        rows, next_cursor = get_products_page(user_id, after=cursors[-1], **filters)
+    
+    if rows:
+        with profile_section("dataframe: products page"):
+            df = pd.DataFrame(rows, columns=['id', 'name', 'supplier', 'quantity', 'min_threshold', 'unit_price', 'category'])
+            df['status'] = ["🔴 Low Stock" if q <= m else "✅ In Stock" for q, m in zip(df['quantity'], df['min_threshold'])]
+        st.dataframe(
+            df.drop(columns=['id']),
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                'name': "📦 Product",
+                'supplier': "🏢 Supplier",
+                'quantity': "📊 Quantity",
+                'min_threshold': "⚠️ Minimum",
+                'unit_price': st.column_config.NumberColumn("💰 Unit Price", format="₹%.2f"),
+                'category': "🏷️ Category",
+                'status': "Status"
+            }
+        )
+    else:
+        st.info("No products match these filters.")
+    
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("⬅️ Previous", disabled=len(cursors) == 1, use_container_width=True):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        st.markdown(f"<p style='text-align: center;'>Page {len(cursors)}</p>", unsafe_allow_html=True)
+    with col3:
+        if st.button("Next ➡️", disabled=next_cursor is None, use_container_width=True):
+            cursors.append(next_cursor)
+            st.rerun()
+    
+    show_export_panel(user_id)
+
+def show_export_panel(user_id):
+    with st.expander("📤 Export Data", expanded=False):
+        col1, col2 = st.columns(2)
+        with col1:
+            kind = st.selectbox("📋 Dataset", options=EXPORT_KINDS,
+                                format_func=lambda k: "Products" if k == "products" else "Inventory logs")
+        with col2:
+            file_format = st.selectbox("📄 Format", options=["CSV", "Parquet"])
+        
+        filters = {}
+        if kind == "inventory_logs":
+            col1, col2 = st.columns(2)
+            with col1:
+                date_range = st.date_input("📅 Date range", value=())
+            with col2:
+                product_search = st.text_input("📦 Product name contains", placeholder="Leave empty for all products")
+            if len(date_range) == 2:
+                filters['start'] = datetime.combine(date_range[0], datetime.min.time())
+                filters['end'] = datetime.combine(date_range[1] + timedelta(days=1), datetime.min.time())
+            if product_search:
+                filters['product_search'] = product_search
+        
+        st.caption(f"Downloads here are limited to {EXPORT_UI_MAX_BYTES // (1024 * 1024)} MB; "
+                   "for larger exports run `python export_data.py` on the server.")
+        
+        if st.button("📦 Prepare Export", use_container_width=True):
+            extension = "csv" if file_format == "CSV" else "parquet"
+            with tempfile.TemporaryFile() as out:
+                try:
+                    # Stop once the file passes the cap instead of building it all for download
+                    capped = CappedWriter(out, EXPORT_UI_MAX_BYTES)
+                    if file_format == "CSV":
+                        export_csv(kind, capped, user_id, **filters)
+                    else:
+                        export_parquet(kind, capped, user_id, **filters)
+                except ValueError as e:
+                    st.error(f"❌ {e}")
+                    return
+                out.seek(0)
+                st.download_button(
+                    f"⬇️ Download {kind}.{extension}",
+                    data=out.read(),
+                    file_name=f"{kind}_{datetime.now():%Y%m%d_%H%M}.{extension}",
+                    mime="text/csv" if extension == "csv" else "application/octet-stream",
+                    use_container_width=True
+                )
+
 def show_add_product():
     st.markdown("""
     <div class="page-header">
@@ -1232,6 +3881,16 @@ def show_add_product():
     """, unsafe_allow_html=True)
     
     user_id = st.session_state.user['id']
+    
+    tab1, tab2 = st.tabs(["✨ Single Product", "📥 Bulk Import"])
+    
+    with tab1:
+        show_add_product_form(user_id)
+    
+    with tab2:
+        show_product_import(user_id)
+
+def show_add_product_form(user_id):
     suppliers = get_suppliers(user_id)
     
     if not suppliers:
@@ -1267,6 +3926,50 @@ def show_add_product():
                 st.success(f"🎉 Product '{name}' added successfully!")
                 st.rerun()
 
+def show_product_import(user_id):
+    st.markdown("### 📥 Import Products from CSV or Excel")
+    st.info("Columns: **" + ", ".join(IMPORT_COLUMNS) + "**. Only name is required; "
+            "supplier must match an existing supplier name. Rows whose name already exists update that product.")
+    
+    st.download_button(
+        "📄 Download CSV template",
+        data=",".join(IMPORT_COLUMNS) + "\n",
+        file_name="products_template.csv",
+        mime="text/csv"
+    )
+    
+    uploaded = st.file_uploader("Upload file", type=["csv", "xlsx"], key="product_import_file")
+    if uploaded and st.button("🚀 Import Products", use_container_width=True):
+        progress = st.progress(0.0, text="Starting import...")
+        total = max(uploaded.size, 1)
+        
+        def on_progress(rows_seen, result):
+            # Progress through the upload in bytes; openpyxl hides its position, so cap at 99%
+            done = min(uploaded.tell() / total, 0.99)
+            progress.progress(done, text=f"Processed {rows_seen:,} rows · {result['inserted']:,} added · "
+                                         f"{result['updated']:,} updated · {len(result['errors']):,} errors")
+        
+        try:
+            result = import_products(read_import_rows(uploaded, uploaded.name), user_id, on_progress=on_progress)
+        except ValueError as e:
+            progress.empty()
+            st.error(f"❌ {e}")
+            return
+        
+        progress.progress(1.0, text="Import finished")
+        st.success(f"🎉 Added {result['inserted']:,} and updated {result['updated']:,} products")
+        
+        if result['errors']:
+            errors_df = pd.DataFrame(result['errors'], columns=['row', 'error'])
+            st.warning(f"⚠️ {len(errors_df):,} rows were skipped")
+            st.dataframe(errors_df.head(100), hide_index=True, use_container_width=True)
+            st.download_button(
+                "📄 Download all errors",
+                data=errors_df.to_csv(index=False),
+                file_name="import_errors.csv",
+                mime="text/csv"
+            )
+
 def show_manage_suppliers():
     st.markdown("""
     <div class="page-header">
@@ -1300,7 +4003,8 @@ def show_manage_suppliers():
                     st.rerun()
     
     with tab2:
-        suppliers = get_suppliers(user_id)
+        with profile_section("fetch: suppliers"):
+            suppliers = get_suppliers(user_id)
         
         if suppliers:
             for supplier in suppliers:
@@ -1322,6 +4026,82 @@ def show_manage_suppliers():
         else:
             st.info("No suppliers found. Add your first supplier!")
 
+def show_inventory_history():
+    st.markdown("""
+    <div class="page-header">
+        <h2 class="page-title">📈 Inventory History</h2>
+        <p class="page-subtitle">Stock movements, consumption and top movers over time</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    user_id = st.session_state.user['id']
+    today = datetime.now().date()
+    
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        date_range = st.date_input("📅 Date range", value=(today - timedelta(days=29), today), max_value=today)
+    with col2:
+        bucket = st.selectbox("🕒 Group by", options=HISTORY_BUCKETS, format_func=str.title)
+    
+    if len(date_range) != 2:
+        st.info("Select a start and end date.")
+        return
+    start, end = date_range
+    
+    with profile_section("fetch: top movers"):
+        movers = get_top_movers(user_id, start, end)
+    product_options = {"All products": None}
+    product_options.update({mover[2]: mover[1] for mover in movers})
+    selected = st.selectbox("📦 Product", options=list(product_options.keys()),
+                            help="Pick one of the top movers to see its own stock level")
+    
+    with profile_section("fetch: stock history"):
+        history = get_stock_history(user_id, start, end, bucket, product_options[selected])
+    with profile_section("dataframe: stock history"):
+        df = pd.DataFrame(history, columns=['date', 'units_in', 'units_out', 'net_change', 'stock_level'])
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("📥 Units In", f"{int(df['units_in'].sum()):,}")
+    with col2:
+        st.metric("📤 Units Out", f"{int(df['units_out'].sum()):,}")
+    with col3:
+        st.metric("📦 Closing Stock", f"{int(df['stock_level'].iloc[-1]):,}" if len(df) else "0")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        with profile_section("chart: stock level"):
+            fig = px.line(df, x='date', y='stock_level', title="📦 Stock Level", markers=True)
+            fig.update_layout(plot_bgcolor='white', paper_bgcolor='white', font_family="Inter", title_font_size=18)
+        st.plotly_chart(fig, use_container_width=True)
+    with col2:
+        with profile_section("chart: units in/out"):
+            fig = px.bar(df, x='date', y=['units_in', 'units_out'], barmode='group', title="🔄 Units In / Out")
+            fig.update_layout(plot_bgcolor='white', paper_bgcolor='white', font_family="Inter", title_font_size=18)
+        st.plotly_chart(fig, use_container_width=True)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("#### 🏆 Top Movers")
+        if movers:
+            st.dataframe(pd.DataFrame(
+                [(rank, name, category, moved, units_in, units_out, share) for rank, _, name, category, moved, units_in, units_out, _, share in movers],
+                columns=['#', 'Product', 'Category', 'Units Moved', 'In', 'Out', 'Share %']
+            ), hide_index=True, use_container_width=True)
+        else:
+            st.info("No stock movements in this range.")
+    with col2:
+        st.markdown("#### 🔥 Consumption Rate")
+        with profile_section("fetch: consumption rates"):
+            rates = get_consumption_rates(user_id, start, end)
+        if rates:
+            st.dataframe(pd.DataFrame(
+                [row[1:] for row in rates],
+                columns=['Product', 'In Stock', 'Used', 'Per Day', 'Days Left']
+            ), hide_index=True, use_container_width=True)
+        else:
+            st.info("No stock was used in this range.")
+
 def show_low_stock_alerts():
     st.markdown("""
     <div class="page-header">
@@ -1331,9 +4111,10 @@ def show_low_stock_alerts():
     """, unsafe_allow_html=True)
     
     user_id = st.session_state.user['id']
-    low_stock = get_low_stock_products(user_id)
+    with profile_section("fetch: low stock"):
+        low_stock_groups = get_low_stock_by_supplier(user_id)
     
-    if not low_stock:
+    if not low_stock_groups:
         st.markdown("""
         <div class="success-card">
             <h3>🎉 All Good!</h3>
@@ -1345,7 +4126,7 @@ def show_low_stock_alerts():
     st.markdown(f"""
     <div class="alert-card">
         <h3>⚠️ Attention Needed</h3>
-        <p>You have <strong>{len(low_stock)}</strong> products running low on stock!</p>
+        <p>You have <strong>{sum(group[3] for group in low_stock_groups)}</strong> products running low on stock!</p>
     </div>
     """, unsafe_allow_html=True)
     
@@ -1357,34 +4138,34 @@ def show_low_stock_alerts():
     </div>
     """, unsafe_allow_html=True)
     
-    # Get all suppliers with low stock items
-    suppliers = get_suppliers(user_id)
-    supplier_options = {}
-    for supplier in suppliers:
-        # Check if this supplier has low stock items
-        supplier_low_stock = [item for item in low_stock if item[2] == supplier[1]]
-        if supplier_low_stock:
-            supplier_options[f"{supplier[1]} ({supplier[2]})"] = {
-                'id': supplier[0],
-                'name': supplier[1],
-                'contact': supplier[2],
-                'items': supplier_low_stock
-            }
+    # Suppliers with low stock items, keyed by id so same-named suppliers stay apart
+    supplier_options = {
+        supplier_id: {
+            'id': supplier_id,
+            'name': name,
+            'contact': contact,
+            'items': items
+        }
+        for supplier_id, name, contact, _, items in low_stock_groups
+        if supplier_id is not None
+    }
     
     if supplier_options:
         col1, col2 = st.columns([1, 1])
         
         with col1:
-            selected_supplier_key = st.selectbox(
+            selected_supplier_id = st.selectbox(
                 "🏢 Select Supplier",
                 options=list(supplier_options.keys()),
+                format_func=lambda s: f"{supplier_options[s]['name']} ({supplier_options[s]['contact']}) · {len(supplier_options[s]['items'])} items",
                 help="Choose supplier to send message to"
             )
             
-            selected_supplier = supplier_options[selected_supplier_key]
+            selected_supplier = supplier_options[selected_supplier_id]
             
             # Template selection
-            templates = get_whatsapp_templates(user_id)
+            with profile_section("fetch: templates"):
+                templates = get_whatsapp_templates(user_id)
             template_options = {f"{t[1]} {'(Default)' if t[3] else ''}": t for t in templates}
             selected_template_name = st.selectbox(
                 "📋 Message Template",
@@ -1401,6 +4182,8 @@ def show_low_stock_alerts():
         st.markdown("### 📦 Select Items to Reorder")
         
         # Items selection with quantities
+        with profile_section("fetch: demand forecast"):
+            forecast = get_demand_forecast(user_id)
         selected_items = []
         for item in selected_supplier['items']:
             col1, col2, col3, col4, col5, col6 = st.columns([0.5, 2, 1, 1, 1, 1.5])
@@ -1412,14 +4195,16 @@ def show_low_stock_alerts():
                 st.markdown(f"**{item[1]}**")
             
             with col3:
-                st.metric("Current", item[3])
+                st.metric("Current", item[2])
             
             with col4:
-                st.metric("Min", item[4])
+                st.metric("Min", item[3])
             
             with col5:
-                suggested = max(1, item[4] * 2 - item[3])
-                st.metric("Suggested", f"+{suggested}")
+                suggested, reorder_point, daily_rate = suggest_reorder(item[0], item[2] + item[5], item[3], forecast)
+                st.metric("Suggested", f"+{suggested}",
+                          help=f"Uses ~{daily_rate:g}/day; reorder point {reorder_point}"
+                               + (f"; {item[5]} already on order" if item[5] else ""))
             
             with col6:
                 if include:
@@ -1430,39 +4215,36 @@ def show_low_stock_alerts():
                         key=f"order_qty_{item[0]}"
                     )
                     selected_items.append({
+                        'product_id': item[0],
                         'name': item[1],
                         'quantity': quantity,
-                        'current_stock': item[3]
+                        'current_stock': item[2],
+                        'unit_price': item[4]
                     })
         
         if selected_items:
             st.markdown("---")
             
             # Message preview
-            preview_message = selected_template[2].replace("{supplier_name}", selected_supplier['name'])
-            items_list = ""
-            for item_data in selected_items:
-                items_list += f"• {item_data['name']}: {item_data['quantity']} units (Current stock: {item_data['current_stock']})\n"
-            preview_message = preview_message.replace("{items_list}", items_list.strip())
-            preview_message = preview_message.replace("{company_name}", company_name)
+            with profile_section("render: message preview"):
+                preview_message = render_reorder_message(
+                    get_compiled_template(selected_template),
+                    selected_supplier['name'],
+                    selected_items,
+                    company_name
+                )
             
             with st.expander("📋 Message Preview", expanded=True):
                 st.text_area("Preview", value=preview_message, height=200, disabled=True)
             
             # Send button
-            whatsapp_url = generate_whatsapp_message(
-                selected_supplier['name'], 
-                selected_supplier['contact'], 
-                selected_items, 
-                selected_template[2], 
-                company_name
-            )
+            send_url = whatsapp_url(selected_supplier['contact'], preview_message)
             
             col1, col2, col3 = st.columns([1, 1, 1])
             with col2:
                 st.markdown(f"""
                 <div style="text-align: center; margin: 1rem 0;">
-                    <a href="{whatsapp_url}" target="_blank" style="
+                    <a href="{send_url}" target="_blank" style="
                         display: inline-block;
                         background: linear-gradient(135deg, #25D366, #128C7E);
                         color: white;
@@ -1481,30 +4263,222 @@ def show_low_stock_alerts():
                     </a>
                 </div>
                 """, unsafe_allow_html=True)
+                
+                if st.button("🧾 Record Purchase Order", use_container_width=True,
+                             help="Track these items as on order so they aren't reordered again"):
+                    order_id = create_purchase_order(selected_supplier['id'], selected_items, user_id)
+                    st.success(f"🧾 Purchase order #{order_id} created")
+                    st.rerun()
+        
+        show_bulk_reorder_composer(low_stock_groups, selected_template, company_name, forecast)
     
     st.markdown("---")
     
     # Traditional view for reference
     st.markdown("### 📊 Low Stock Items by Supplier")
     
-    # Group by supplier
-    supplier_groups = {}
-    for item in low_stock:
-        supplier = item[2] or "Unknown Supplier"
-        if supplier not in supplier_groups:
-            supplier_groups[supplier] = []
-        supplier_groups[supplier].append(item)
-    
-    for supplier_name, items in supplier_groups.items():
-        with st.expander(f"🏢 {supplier_name} ({len(items)} items)", expanded=False):
+    for supplier_id, supplier_name, _, item_count, items in low_stock_groups:
+        with st.expander(f"🏢 {supplier_name or 'Unknown Supplier'} ({item_count} items)", expanded=False):
             for item in items:
                 col1, col2, col3 = st.columns([3, 1, 1])
                 with col1:
                     st.write(f"📦 **{item[1]}**")
                 with col2:
-                    st.metric("Current", item[3])
+                    st.metric("Current", item[2])
                 with col3:
-                    st.metric("Minimum", item[4])
+                    st.metric("Minimum", item[3])
+
+def show_bulk_reorder_composer(low_stock_groups, template, company_name, forecast):
+    """Messages for every supplier at their suggested quantities, as links and a download bundle"""
+    with st.expander(f"📤 Compose for all {len([g for g in low_stock_groups if g[0] is not None])} suppliers", expanded=False):
+        st.caption("Uses the template and company name above with each item's suggested quantity.")
+        with profile_section("render: bulk messages"):
+            messages = compose_reorder_messages(low_stock_groups, get_compiled_template(template), company_name, forecast)
+        
+        st.dataframe(
+            pd.DataFrame(messages, columns=['supplier', 'phone', 'items', 'url']),
+            column_config={"url": st.column_config.LinkColumn("WhatsApp", display_text="📱 Open chat")},
+            hide_index=True,
+            use_container_width=True
+        )
+        
+        col1, col2 = st.columns(2)
+        stamp = f"{datetime.now():%Y%m%d_%H%M}"
+        with col1:
+            st.download_button("⬇️ Download CSV", data=reorder_messages_csv(messages),
+                               file_name=f"reorder_messages_{stamp}.csv", mime="text/csv",
+                               use_container_width=True)
+        with col2:
+            st.download_button("⬇️ Download JSON", data=json.dumps(messages, ensure_ascii=False, indent=2),
+                               file_name=f"reorder_messages_{stamp}.json", mime="application/json",
+                               use_container_width=True)
+        
+        if st.button(f"📨 Queue all {len(messages)} messages", use_container_width=True,
+                     help="Send through the WhatsApp gateway in the background"):
+            queued = enqueue_messages(messages, st.session_state.user['id'])
+            st.success(f"📨 Queued {queued} messages for delivery")
+            if queued < len(messages):
+                st.info(f"{len(messages) - queued} identical messages were already queued today and were skipped")
+        
+        with profile_section("fetch: outbox status"):
+            status = get_outbox_status(st.session_state.user['id'])
+        if status:
+            st.caption(" · ".join(f"{name.title()}: {status.get(name, 0)}" for name in ('pending', 'sending', 'sent', 'failed')))
+
+def show_purchase_orders():
+    st.markdown("""
+    <div class="page-header">
+        <h2 class="page-title">🧾 Purchase Orders</h2>
+        <p class="page-subtitle">Track reorders and receive delivered goods into stock</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    user_id = st.session_state.user['id']
+    
+    tab1, tab2, tab3 = st.tabs(["📬 Open", "✅ Received", "❌ Cancelled"])
+    
+    with tab1:
+        with profile_section("fetch: open orders"):
+            orders = get_purchase_orders(user_id, "open")
+        if not orders:
+            st.info("No open purchase orders. Record one from the Alerts page composer.")
+        
+        for order_id, supplier, _, created_at, _, total_value, lines in orders:
+            with st.expander(f"🧾 PO #{order_id} · {supplier or 'Unknown Supplier'} · {len(lines)} items · ₹{total_value:,.2f} · {created_at:%d %b %Y}"):
+                with st.form(f"receive_po_{order_id}"):
+                    df = pd.DataFrame(
+                        [(product_id, name, quantity, quantity) for product_id, name, quantity, _, _ in lines],
+                        columns=['product_id', 'Product', 'Ordered', 'Received']
+                    )
+                    edited = st.data_editor(
+                        df,
+                        column_config={
+                            "product_id": None,
+                            "Received": st.column_config.NumberColumn(min_value=0, step=1, required=True),
+                        },
+                        disabled=['Product', 'Ordered'],
+                        hide_index=True,
+                        use_container_width=True,
+                        key=f"po_lines_{order_id}"
+                    )
+                    
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        receive = st.form_submit_button("📥 Receive into Stock", type="primary", use_container_width=True)
+                    with col2:
+                        cancel = st.form_submit_button("❌ Cancel Order", use_container_width=True)
+                    
+                    if receive:
+                        received = dict(zip(edited['product_id'].astype(int), edited['Received'].astype(int)))
+                        applied = receive_purchase_order(order_id, user_id, received)
+                        if applied is None:
+                            st.error("❌ This order is no longer open")
+                        else:
+                            st.success(f"📥 Received {sum(received.values())} units across {len(applied)} products")
+                            st.rerun()
+                    if cancel:
+                        cancel_purchase_order(order_id, user_id)
+                        st.rerun()
+    
+    for tab, status in ((tab2, "received"), (tab3, "cancelled")):
+        with tab:
+            with profile_section("fetch: closed orders"):
+                orders = get_purchase_orders(user_id, status)
+            if not orders:
+                st.info(f"No {status} purchase orders yet.")
+                continue
+            st.dataframe(pd.DataFrame(
+                [(f"#{order_id}", supplier or 'Unknown Supplier', len(lines), sum(line[4] or 0 for line in lines),
+                  total_value, created_at, closed_at)
+                 for order_id, supplier, _, created_at, closed_at, total_value, lines in orders],
+                columns=['PO', 'Supplier', 'Items', 'Units Received', 'Value (₹)', 'Created', 'Closed']
+            ), hide_index=True, use_container_width=True)
+
+def show_db_metrics():
+    st.markdown("""
+    <div class="page-header">
+        <h2 class="page-title">🔬 Database Metrics</h2>
+        <p class="page-subtitle">Statement timings for this app process since it started</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    snapshot = get_db_metrics().snapshot()
+    acquire_count, acquire_total, acquire_p95 = snapshot['acquire']
+    reruns = snapshot['connections_per_rerun']
+    rerun_count = sum(reruns.values())
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Statements", f"{sum(q[1] for q in snapshot['queries']):,}")
+    with col2:
+        st.metric("Avg Pool Wait", f"{acquire_total / acquire_count:.2f} ms" if acquire_count else "-",
+                  help=f"p95 ≤ {acquire_p95} ms" if acquire_p95 is not None else "p95 -")
+    with col3:
+        st.metric("Reruns", f"{rerun_count:,}")
+    with col4:
+        st.metric("Connections / Rerun", f"{sum(n * c for n, c in reruns.items()) / rerun_count:.1f}" if rerun_count else "-")
+    
+    st.markdown("#### ⏱️ Time by Query")
+    st.dataframe(pd.DataFrame(
+        sorted(snapshot['queries'], key=lambda q: q[2], reverse=True),
+        columns=['Query', 'Calls', 'Total ms', 'Mean ms', 'p95 ≤ ms', 'Rows', 'Errors']
+    ).round(2), hide_index=True, use_container_width=True)
+    
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        st.markdown("#### 🐢 Slowest Statements")
+        st.dataframe(pd.DataFrame(
+            [(round(ms, 2), datetime.fromtimestamp(at), name, user_id, statement)
+             for ms, at, name, user_id, statement in snapshot['slowest']],
+            columns=['ms', 'At', 'Query', 'User', 'Statement']
+        ), hide_index=True, use_container_width=True)
+    with col2:
+        st.markdown("#### 🏋️ Heaviest Tenants")
+        st.dataframe(pd.DataFrame(
+            sorted(snapshot['tenants'], key=lambda t: t[2], reverse=True)[:20],
+            columns=['User', 'Statements', 'Total ms']
+        ).round(2), hide_index=True, use_container_width=True)
+    
+    st.download_button("⬇️ Prometheus snapshot", data=get_db_metrics().prometheus(),
+                       file_name="metrics.txt", mime="text/plain")
+
+def show_profile_breakdown(profiler, history):
+    """Sidebar flame graph of this rerun's sections, with phase totals and recent reruns"""
+    total = profiler.total_ms
+    self_times = profiler.self_times()
+    with st.sidebar:
+        st.markdown("### ⏱️ Rerun Profile")
+        st.caption(f"{profiler.page} · {total:,.1f} ms · remove ?profile=1 from the URL to stop")
+        
+        phases = profiler.phases()
+        st.dataframe(pd.DataFrame(
+            [(phase, ms, ms / total * 100 if total else 0) for phase, ms in sorted(phases.items(), key=lambda p: p[1], reverse=True)],
+            columns=['Phase', 'ms', '%']
+        ).round(1), hide_index=True, use_container_width=True)
+        
+        # Root at the bottom, children stacked above, width proportional to time
+        paths = list(profiler.sections)
+        fig = go.Figure(go.Icicle(
+            ids=["/".join(path) for path in paths],
+            labels=[path[-1] for path in paths],
+            parents=["/".join(path[:-1]) for path in paths],
+            values=[self_times[path] for path in paths],
+            branchvalues="remainder",
+            tiling=dict(orientation="v", flip="y"),
+            hovertemplate="%{label}<br>%{value:.1f} ms self<br>%{percentRoot:.1%} of rerun<extra></extra>",
+        ))
+        fig.update_layout(margin=dict(t=0, l=0, r=0, b=0), height=120 + 40 * max(len(path) for path in paths))
+        st.plotly_chart(fig, use_container_width=True)
+        
+        st.dataframe(pd.DataFrame(
+            [("  " * (len(path) - 1) + path[-1], ms, self_times[path], calls) for path, (ms, calls) in profiler.sections.items()],
+            columns=['Section', 'Total ms', 'Self ms', 'Calls']
+        ).round(1), hide_index=True, use_container_width=True)
+        
+        st.markdown("#### Recent Reruns")
+        st.dataframe(pd.DataFrame(history[::-1]).fillna(0).round(1), hide_index=True, use_container_width=True)
+        if profiler.dump_path:
+            st.caption(f"cProfile stats: `{profiler.dump_path}`")
 
 def show_whatsapp_templates():
     st.markdown("""
@@ -1516,12 +4490,7 @@ def show_whatsapp_templates():
     
     user_id = st.session_state.user['id']
     
-    # Ensure templates table exists
-    try:
-        templates = get_whatsapp_templates(user_id)
-    except:
-        # If table doesn't exist, create it
-        init_whatsapp_templates(user_id)
+    with profile_section("fetch: templates"):
         templates = get_whatsapp_templates(user_id)
     
     tab1, tab2 = st.tabs(["📝 Create Template", "📋 Manage Templates"])
@@ -1533,13 +4502,10 @@ def show_whatsapp_templates():
             template_name = st.text_input("📌 Template Name", placeholder="e.g., Urgent Reorder, Monthly Order")
             
             st.markdown("**Available Placeholders:**")
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.info("🏢 **{supplier_name}** - Supplier's name")
-            with col2:
-                st.info("📦 **{items_list}** - List of items to order")
-            with col3:
-                st.info("🏪 **{company_name}** - Your company name")
+            columns = st.columns(3)
+            for i, (field, description) in enumerate(TEMPLATE_FIELDS.items()):
+                with columns[i % 3]:
+                    st.info(f"**{{{field}}}** - {description}")
             
             template_text = st.text_area(
                 "📝 Message Template",
@@ -1559,16 +4525,17 @@ Best regards,
             # Preview section
             if template_text:
                 st.markdown("### 👀 Preview")
-                preview = template_text.replace("{supplier_name}", "ABC Supplies")
-                preview = preview.replace("{items_list}", "• Product A: 50 units (Current stock: 5)\n• Product B: 30 units (Current stock: 2)")
-                preview = preview.replace("{company_name}", "Your Company")
-                
+                preview = render_reorder_message(compile_template(template_text), "ABC Supplies", PREVIEW_ITEMS, "Your Company")
                 st.text_area("Preview", value=preview, height=150, disabled=True)
             
             submitted = st.form_submit_button("💾 Save Template", use_container_width=True)
             
             if submitted and template_name and template_text:
-                template_id = add_whatsapp_template(template_name, template_text, user_id)
+                try:
+                    template_id = add_whatsapp_template(template_name, template_text, user_id)
+                except ValueError as e:
+                    st.error(f"❌ {e}")
+                    template_id = None
                 if template_id:
                     st.success(f"🎉 Template '{template_name}' created successfully!")
                     st.rerun()
@@ -1604,10 +4571,14 @@ Best regards,
                                         cancel_btn = st.form_submit_button("❌ Cancel", use_container_width=True)
                                     
                                     if save_btn and new_name and new_content:
-                                        update_whatsapp_template(template[0], new_name, new_content, user_id)
-                                        st.session_state[f"edit_mode_{template[0]}"] = False
-                                        st.success("Template updated!")
-                                        st.rerun()
+                                        try:
+                                            update_whatsapp_template(template[0], new_name, new_content, user_id)
+                                        except ValueError as e:
+                                            st.error(f"❌ {e}")
+                                        else:
+                                            st.session_state[f"edit_mode_{template[0]}"] = False
+                                            st.success("Template updated!")
+                                            st.rerun()
                                     
                                     if cancel_btn:
                                         st.session_state[f"edit_mode_{template[0]}"] = False
@@ -1632,4 +4603,13 @@ Best regards,
             st.info("No custom templates found. Create your first template above!")
 
 if __name__ == "__main__":
-    main()
+    metrics = get_db_metrics()
+    metrics.begin_rerun()
+    try:
+        if profiling_requested():
+            run_profiled(main)
+        else:
+            st.session_state.profiler = None
+            main()
+    finally:
+        metrics.end_rerun()
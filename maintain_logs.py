@@ -0,0 +1,46 @@
+"""Create upcoming inventory_logs partitions and retire expired ones.
+
+Usage:
+    DB_URL=postgresql://... python maintain_logs.py [--months-ahead N]
+        [--retention-months N] [--skip-expire]
+
+Run it daily or at least monthly (e.g. from cron). Rows written for a month
+without a partition (including back-dated ones) land in
+inventory_logs_default; each run gives every such month its own
+inventory_logs_pYYYYMM partition and moves the rows into it. Partitions
+older than the retention window are summarised into inventory_log_daily and
+dropped, so history charts keep working from the daily rollups.
+"""
+import argparse
+
+import main
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Maintain monthly inventory_logs partitions")
+    parser.add_argument("--months-ahead", type=int, default=main.INVENTORY_LOG_MONTHS_AHEAD,
+                        help="Create partitions this many months past the current one")
+    parser.add_argument("--retention-months", type=int, default=main.INVENTORY_LOG_RETENTION_MONTHS,
+                        help="Keep raw rows for this many months before the current one")
+    parser.add_argument("--skip-expire", action="store_true",
+                        help="Only create partitions; keep every raw row")
+    return parser.parse_args()
+
+
+def run():
+    args = parse_args()
+    main.init_main_database()
+
+    created = main.create_inventory_log_partitions(args.months_ahead)
+    print(f"Created {created} partition(s)")
+
+    if not args.skip_expire:
+        dropped = main.expire_inventory_log_partitions(args.retention_months)
+        if dropped:
+            print("Rolled up and dropped", ", ".join(dropped))
+        else:
+            print("No partitions past the retention window")
+
+
+if __name__ == "__main__":
+    run()
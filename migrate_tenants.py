@@ -0,0 +1,50 @@
+"""Move legacy per-user tables (products_<id>, suppliers_<id>, ...) into the
+shared tenant tables.
+
+Usage:
+    DB_URL=postgresql://... python migrate_tenants.py [--user-id ID ...]
+        [--batch-size N] [--drop-legacy] [--enable-rls]
+
+Each tenant is copied in its own transaction and recorded in
+schema_migrations, so the command can be interrupted and re-run. Tenants
+that log in before it runs are migrated on their first login.
+"""
+import argparse
+
+import main
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Migrate per-user tables into the shared tenant schema")
+    parser.add_argument("--user-id", type=int, action="append", dest="user_ids",
+                        help="Only migrate this user (repeatable); defaults to every legacy tenant")
+    parser.add_argument("--batch-size", type=int, default=main.LEGACY_MIGRATION_BATCH_SIZE,
+                        help="Rows copied per INSERT ... SELECT statement")
+    parser.add_argument("--drop-legacy", action="store_true",
+                        help="Drop each tenant's per-user tables once its rows are copied")
+    parser.add_argument("--enable-rls", action="store_true",
+                        help="Enable row-level security policies keyed on the app.user_id setting")
+    return parser.parse_args()
+
+
+def run():
+    args = parse_args()
+    main.init_main_database()
+
+    user_ids = args.user_ids or main.find_legacy_tenants()
+    print(f"Migrating {len(user_ids)} tenant(s)")
+    for user_id in user_ids:
+        copied = main.migrate_legacy_tenant(user_id, batch_size=args.batch_size, drop_legacy=args.drop_legacy)
+        if copied is None:
+            print(f"  user {user_id}: nothing to migrate")
+        else:
+            summary = ", ".join(f"{table}={count}" for table, count in copied.items())
+            print(f"  user {user_id}: {summary}")
+
+    if args.enable_rls:
+        main.enable_tenant_rls()
+        print("Row-level security enabled on", ", ".join(main.TENANT_TABLES))
+
+
+if __name__ == "__main__":
+    run()
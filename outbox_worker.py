@@ -0,0 +1,161 @@
+"""Deliver queued reorder messages from message_outbox through a gateway.
+
+Usage:
+    DB_URL=postgresql://... python outbox_worker.py [--gateway URL|log]
+        [--rate-per-minute N] [--batch-size N] [--concurrency N] [--once]
+
+The worker runs as its own process next to the Streamlit app. It claims
+batches with FOR UPDATE SKIP LOCKED (so several workers can share the
+queue), sends them concurrently under a token-bucket rate limit, and
+records the whole batch's results in one statement. Failed sends are
+retried with exponential backoff; see OUTBOX_* in main.py.
+
+``--gateway`` takes an HTTP endpoint that accepts ``POST {"to", "text"}``
+(for local testing, run whatsapp_gateway_stub.py), or ``log`` to print
+messages instead of sending them. WHATSAPP_GATEWAY_URL and
+WHATSAPP_GATEWAY_TOKEN set the defaults.
+"""
+import abc
+import argparse
+import asyncio
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+
+import main
+
+
+class GatewayError(Exception):
+    """Delivery failed; ``retryable`` says whether a later attempt may succeed"""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class Gateway(abc.ABC):
+    """Interface for message transports"""
+
+    @abc.abstractmethod
+    async def send(self, phone, message):
+        """Deliver one message, raising GatewayError on failure"""
+
+
+class LogGateway(Gateway):
+    """Print messages instead of sending them"""
+
+    async def send(self, phone, message):
+        print(f"[to {phone}] {message.splitlines()[0] if message else ''}")
+
+
+class HttpGateway(Gateway):
+    """POST each message as JSON to an HTTP gateway"""
+
+    def __init__(self, url, token=None, timeout=10):
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+
+    def _post(self, phone, message):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps({"to": phone, "text": message}).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        if self.token:
+            request.add_header("Authorization", f"Bearer {self.token}")
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            # Rate limits and server errors are worth retrying; other 4xx are not
+            raise GatewayError(f"HTTP {e.code}: {e.reason}", retryable=e.code == 429 or e.code >= 500)
+        except (urllib.error.URLError, OSError) as e:
+            raise GatewayError(str(e))
+
+    async def send(self, phone, message):
+        await asyncio.to_thread(self._post, phone, message)
+
+
+class RateLimiter:
+    """Token bucket allowing ``rate`` sends per second with bursts up to ``burst``"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+async def deliver(gateway, limiter, semaphore, claimed):
+    message_id, phone, message, attempts, claimed_at = claimed
+    async with semaphore:
+        await limiter.acquire()
+        try:
+            await gateway.send(phone, message)
+        except GatewayError as e:
+            return message_id, claimed_at, attempts, str(e), e.retryable
+        except Exception as e:
+            return message_id, claimed_at, attempts, f"{type(e).__name__}: {e}", True
+    return message_id, claimed_at, attempts, None, False
+
+
+async def run_worker(gateway, rate_per_minute, batch_size, concurrency, poll_seconds=2.0, once=False):
+    limiter = RateLimiter(rate_per_minute / 60, burst=max(1, min(batch_size, rate_per_minute // 6)))
+    semaphore = asyncio.Semaphore(concurrency)
+    while True:
+        batch = await asyncio.to_thread(main.claim_outbox_messages, batch_size)
+        if not batch:
+            if once:
+                return
+            await asyncio.sleep(poll_seconds)
+            continue
+        results = await asyncio.gather(*(deliver(gateway, limiter, semaphore, claimed) for claimed in batch))
+        await asyncio.to_thread(main.complete_outbox_messages, results)
+        failed = sum(1 for result in results if result[3] is not None)
+        print(f"Delivered {len(results) - failed}/{len(results)} message(s)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Deliver queued WhatsApp reorder messages")
+    parser.add_argument("--gateway", default=os.getenv("WHATSAPP_GATEWAY_URL", "log"),
+                        help="Gateway endpoint URL, or 'log' to print messages")
+    parser.add_argument("--rate-per-minute", type=int, default=int(os.getenv("OUTBOX_RATE_PER_MINUTE", "600")))
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("OUTBOX_BATCH_SIZE", "50")),
+                        help="Messages claimed per round trip")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("OUTBOX_CONCURRENCY", "10")),
+                        help="Sends in flight at once")
+    parser.add_argument("--once", action="store_true", help="Exit when nothing is due instead of polling")
+    return parser.parse_args()
+
+
+def run():
+    args = parse_args()
+    main.init_main_database()
+    if args.gateway == "log":
+        gateway = LogGateway()
+    else:
+        gateway = HttpGateway(args.gateway, token=os.getenv("WHATSAPP_GATEWAY_TOKEN"))
+    try:
+        asyncio.run(run_worker(gateway, args.rate_per_minute, args.batch_size, args.concurrency, once=args.once))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    run()
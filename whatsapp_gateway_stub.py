@@ -0,0 +1,88 @@
+"""Local stand-in for a WhatsApp gateway, for exercising outbox_worker.py.
+
+Usage:
+    python whatsapp_gateway_stub.py [--port 8088] [--fail-rate 0.1] [--latency 0.2]
+    DB_URL=... python outbox_worker.py --gateway http://127.0.0.1:8088/messages
+
+Accepts ``POST /messages`` with ``{"to": ..., "text": ...}`` and answers
+``{"id": n, "status": "accepted"}``. With ``--fail-rate`` a share of
+requests get a 503 so retries can be observed. Accepted messages are
+printed, or appended as JSON lines to ``--log``.
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(fail_rate, latency, log_file):
+    ids = itertools.count(1)
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, body):
+            payload = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            if self.path != "/messages":
+                return self._reply(404, {"error": "not found"})
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                to, text = body["to"], body["text"]
+            except (ValueError, KeyError):
+                return self._reply(400, {"error": "expected JSON with 'to' and 'text'"})
+
+            time.sleep(latency)
+            if random.random() < fail_rate:
+                return self._reply(503, {"error": "simulated outage"})
+
+            with lock:
+                message_id = next(ids)
+                if log_file:
+                    log_file.write(json.dumps({"id": message_id, "to": to, "text": text}) + "\n")
+                    log_file.flush()
+                else:
+                    print(f"#{message_id} to {to}: {text.splitlines()[0] if text else ''}")
+            self._reply(200, {"id": message_id, "status": "accepted"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run a local WhatsApp gateway stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before answering")
+    parser.add_argument("--log", help="Append accepted messages to this file as JSON lines")
+    return parser.parse_args()
+
+
+def run():
+    args = parse_args()
+    log_file = open(args.log, "a", encoding="utf-8") if args.log else None
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args.fail_rate, args.latency, log_file))
+    print(f"Gateway stub listening on http://{args.host}:{args.port}/messages")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if log_file:
+            log_file.close()
+
+
+if __name__ == "__main__":
+    run()